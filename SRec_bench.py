@@ -0,0 +1,510 @@
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from functools import partial
+from itertools import cycle
+
+import SRecord as sr
+import SRecordCache as src
+import SRecordConvert as srcv
+import SRecordDiff as srd
+import SRecordFile as srf
+import SRecordImage as sri
+import SRecordQuery as srq
+
+#####################################################
+# Synthetic SRecord files, used to benchmark the tool
+#####################################################
+
+def generate_srec(path, size, data_len = 32, s_type = 'S3', start = 0, seed = 0, sectors = 1, gaps = (0,)):
+    '''
+    write a deterministic SRecord file of 'size' data bytes in 'path'
+        Input   * size : number of data bytes
+                * data_len : number of data bytes per SRecord
+                * s_type : type of the data SRecords ('S1', 'S2' or 'S3')
+                * start : address of the first data byte
+                * sectors : number of sectors the data is split in
+                * gaps : sizes of the gaps between the sectors, used one after the other
+                         (the first one again after the last one)
+    '''
+    rnd = random.Random(seed)
+    footer = srcv.FOOTER_OF[s_type]
+    sector_size = -(-size // sectors)
+    with open(path, 'w') as srec_f:
+        srec_f.write(sr.format_srec('S0', 0, b'SRec_bench') + '\n')
+        address = start
+        for gap, sector_start in zip(cycle(gaps), range(0, size, sector_size)):
+            sector_end = address + min(sector_size, size - sector_start)
+            if sector_end - 1 >= 1 << 8*sr.SRecord.ADDR_LEN[s_type]:
+                raise ValueError(f"The data doesn't fit in {s_type} SRecords, use a wider type")
+            while address < sector_end:
+                length = min(data_len, sector_end - address)
+                srec_f.write(sr.format_srec(s_type, address, rnd.getrandbits(8*length).to_bytes(length, 'little')) + '\n')
+                address += length
+            address += gap
+        srec_f.write(sr.format_srec(footer, start, b'') + '\n')
+
+#Shape of the files generated for the benchmarks
+BenchConfig = collections.namedtuple('BenchConfig', ['size', 'data_len', 's_type', 'sectors', 'gaps', 'jobs'])
+
+def bench_file(config, tmp_dir, size = None):
+    '''
+    generate the file of config (of size data bytes if given) in tmp_dir, return its path
+    '''
+    path = os.path.join(tmp_dir, 'bench.s19')
+    generate_srec(path, size or config.size, config.data_len, config.s_type, sectors=config.sectors, gaps=config.gaps)
+    return path
+
+def largest_sector(file):
+    return max(file.sectors, key=lambda sector: sector.end - sector.start)
+
+def load_quiet(file_class, path):
+    '''
+    load path with file_class, without printing the file infos
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        return file_class(path)
+
+#########################################################
+# Results : printed, and kept to be written as JSON to
+# follow the throughput of the tool from a commit to another
+#########################################################
+
+results = []
+
+def report(bench, case, duration = None, nb_bytes = None, nb_records = None, **values):
+    '''
+    print and keep the result of a case of a benchmark
+        Input   * duration : time spent, in seconds
+                * nb_bytes, nb_records : bytes and SRecords processed during duration,
+                                         to compute the throughput (MB/s, records/s)
+                * values : any other measure (e.g. a memory footprint, a number of matches)
+    '''
+    result = {'bench' : bench, 'case' : case}
+    parts = []
+    if duration is not None:
+        result['ms'] = round(duration*1000, 3)
+        parts.append(f"{duration*1000:9.1f} ms")
+        if nb_bytes is not None:
+            result['mb_per_s'] = round(nb_bytes/duration/1e6, 3)
+            parts.append(f"{nb_bytes/duration/1e6:8.1f} MB/s")
+        if nb_records is not None:
+            result['records_per_s'] = round(nb_records/duration)
+            parts.append(f"{nb_records/duration:10.0f} records/s")
+    result.update(values)
+    parts += [f"{name} {value}" for name, value in values.items()]
+    results.append(result)
+    print(f"   {case:<24}: {', '.join(parts)}")
+
+def git_commit():
+    '''
+    return the commit the benchmarks are run on, None if it can't be found
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_json(name, config):
+    with open(name, 'w') as json_f:
+        json.dump({'commit' : git_commit(), 'python' : platform.python_version(), 'platform' : platform.platform(),
+                   'config' : config._asdict(), 'results' : results}, json_f, indent=2)
+
+#######################
+# Memory footprint bench
+#######################
+
+class LegacySRecord:
+    '''
+    Mimics the per-byte layout SRecord used to have (one hex string list plus one
+    int list), to be able to compare its footprint with the current one
+    '''
+    def __init__(self, srec):
+        srec = srec.strip()
+        addr_char = sr.SRecord.ADDR_LEN[srec[:2]]*2
+        self.s_type = srec[:2]
+        self.count_h = srec[2:4]
+        self.count_u = sr.INT(self.count_h)
+        self.address_h = srec[4: 4 + addr_char]
+        self.address_u = sr.INT(self.address_h)
+        data = srec[4 + addr_char: -2]
+        self.data_h = [data[i:i+2] for i in range(0, len(data), 2)]
+        self.data_u = [sr.INT(byte) for byte in self.data_h]
+        self.checksum = srec[-2:]
+
+def measure_footprint(record_class, lines):
+    '''
+    return the memory (in bytes) allocated to keep alive the records built from lines
+    '''
+    tracemalloc.start()
+    records = [record_class(line) for line in lines]
+    footprint = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return footprint
+
+def measure_load_footprint(loader, path):
+    '''
+    return the memory (in bytes) allocated to keep alive the file loaded by loader
+    '''
+    tracemalloc.start()
+    SRec_f = load_quiet(loader, path)
+    footprint = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del SRec_f
+    return footprint
+
+def bench_memory(config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        with open(path, 'r') as srec_f:
+            lines = srec_f.read().splitlines()
+        print(f"Memory used by {len(lines)} SRecords, {config.size} data bytes")
+        for record_class in (LegacySRecord, sr.SRecord):
+            footprint = measure_footprint(record_class, lines)
+            report('memory', record_class.__name__, footprint_bytes=footprint, bytes_per_record=round(footprint/len(lines), 1))
+        for name, loader in (('SRecordFile', srf.SRecordFile),
+                             ('SRecordFile lazy', partial(srf.SRecordFile, lazy=True)),
+                             ('SRecordImage', sri.SRecordImage)):
+            footprint = measure_load_footprint(loader, path)
+            report('memory', name, footprint_bytes=footprint, bytes_per_record=round(footprint/len(lines), 1))
+
+###############
+# Opening a file
+###############
+
+def bench_parse(config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        file_size = os.path.getsize(path)
+        print(f"Opening a {file_size} bytes file")
+        for name, loader in (('SRecordFile', srf.SRecordFile),
+                             ('SRecordFile lazy', partial(srf.SRecordFile, lazy=True)),
+                             ('SRecordImage', sri.SRecordImage)):
+            start = time.perf_counter()
+            SRec_f = load_quiet(loader, path)
+            duration = time.perf_counter() - start
+            report('parse', name, duration, file_size, len(SRec_f.addr_list))
+            del SRec_f
+        with open(path, 'r') as srec_f:
+            lines = srec_f.read().splitlines()
+        start = time.perf_counter()
+        srecords = [sr.SRecord(line) for line in lines]
+        report('parse', 'SRecord', time.perf_counter() - start, file_size, len(srecords))
+
+#######################################
+# Looking up the SRecord of an address
+#######################################
+
+def bench_lookup(config, nb_lookups = 100000):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        print(f"Looking up the SRecords of {nb_lookups} random addresses")
+        for name, loader in (('SRecordFile', srf.SRecordFile),
+                             ('SRecordFile lazy', partial(srf.SRecordFile, lazy=True)),
+                             ('SRecordImage', sri.SRecordImage)):
+            SRec_f = load_quiet(loader, path)
+            rnd = random.Random(0)
+            addresses = [rnd.randint(sector.start, sector.end) for sector in rnd.choices(SRec_f.sectors, k=nb_lookups)]
+            start = time.perf_counter()
+            for address in addresses:
+                SRec_f.get_data_coord(address)
+            report('lookup', name, time.perf_counter() - start, nb_records=nb_lookups)
+
+###########################
+# Patching a calibration block
+###########################
+
+def bench_patch(config, patch_size = 0x10000):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        print(f"Patching a block of (up to) {patch_size} bytes")
+        for file_class in (srf.SRecordFile, sri.SRecordImage):
+            SRec_f = load_quiet(file_class, path)
+            sector = largest_sector(SRec_f)
+            size = min(patch_size, sector.end - sector.start + 1)
+            value = bytes(range(256)) * (size // 256) + bytes(size % 256)
+            address = sector.start + (sector.end - sector.start + 1 - size) // 2
+            start = time.perf_counter()
+            SRec_f.patch_SRecord_File(f"{address:X}", value.hex())
+            report('patch', file_class.__name__, time.perf_counter() - start, size)
+
+##########################
+# Patching a 1 MB region
+##########################
+
+def bench_write(config, write_size = 1 << 20):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir, max(config.size, 2*write_size*config.sectors))
+        print(f"Writing a {write_size} bytes region")
+        #byte by byte, as patching used to be done, timed on 1/16 of the region
+        SRec_f = load_quiet(srf.SRecordFile, path)
+        sector = largest_sector(SRec_f)
+        value = bytes(range(256)) * (write_size // 256)
+        start = time.perf_counter()
+        for offset in range(write_size // 16):
+            SRec_f[sector.start + offset] = f"{value[offset]:02X}"
+        report('write', 'byte by byte', 16*(time.perf_counter() - start), write_size, extrapolated=True)
+        for file_class in (srf.SRecordFile, sri.SRecordImage):
+            SRec_f = load_quiet(file_class, path)
+            start = time.perf_counter()
+            SRec_f.write_range(sector.start, value)
+            report('write', file_class.__name__, time.perf_counter() - start, write_size)
+
+#################################
+# Parallel parsing and validation
+#################################
+
+def bench_parallel(config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        file_size = os.path.getsize(path)
+        print(f"Parsing and validating a {file_size} bytes file with 1 to {config.jobs} processes")
+        for workers in range(1, config.jobs + 1):
+            for label, file_class in (('file', srf.SRecordFile), ('image', sri.SRecordImage)):
+                start = time.perf_counter()
+                load_quiet(partial(file_class, workers=workers), path)
+                report('parallel', f"{label}, {workers} process(es)", time.perf_counter() - start, file_size)
+            start = time.perf_counter()
+            srf.validate_file(path, workers)
+            report('parallel', f"validate, {workers} process(es)", time.perf_counter() - start, file_size)
+
+##########
+# Checksums
+##########
+
+def bench_checksum(config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        SRec_f = load_quiet(srf.SRecordFile, path)
+        nb_records = len(SRec_f.data)
+        print(f"Checking the checksums of {nb_records} SRecords")
+        start = time.perf_counter()
+        for srec in SRec_f.data.values():
+            srec.checksum_u != srec.compute_checksum_u()
+        report('checksum', 'one by one', time.perf_counter() - start, config.size, nb_records)
+        start = time.perf_counter()
+        SRec_f.verify_checksums()
+        report('checksum', 'verify_checksums', time.perf_counter() - start, config.size, nb_records)
+        start = time.perf_counter()
+        SRec_f.fix_checksums()
+        report('checksum', 'fix_checksums', time.perf_counter() - start, config.size, nb_records)
+
+###################
+# Writing the file
+###################
+
+def bench_export(config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        file_size = os.path.getsize(path)
+        print(f"Writing a {file_size} bytes file")
+        for file_class in (srf.SRecordFile, sri.SRecordImage):
+            SRec_f = load_quiet(file_class, path)
+            start = time.perf_counter()
+            SRec_f.export(os.path.join(tmp_dir, 'export.s19'))
+            report('export', file_class.__name__, time.perf_counter() - start, file_size, len(SRec_f.addr_list))
+
+################
+# Strings scanning
+################
+
+def bench_strings(config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        SRec_f = load_quiet(srf.SRecordFile, path)
+        print(f"Looking for strings in {config.size} bytes of data")
+        for charset in srq.CHARSETS:
+            start = time.perf_counter()
+            nb_strings = sum(1 for found in srq.iter_strings(SRec_f, 4, charset))
+            report('strings', charset, time.perf_counter() - start, config.size, strings=nb_strings)
+
+#####################
+# Searching a pattern
+#####################
+
+def bench_find(config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        print(f"Looking for a 4 bytes pattern in {config.size} bytes of data")
+        for file_class in (srf.SRecordFile, sri.SRecordImage):
+            SRec_f = load_quiet(file_class, path)
+            for pattern in ('12345678', '12 3? 56 78'):
+                start = time.perf_counter()
+                nb_found = sum(1 for address in srq.find(SRec_f, *srq.parse_pattern(pattern)))
+                report('find', f"{file_class.__name__} {pattern}", time.perf_counter() - start, config.size, found=nb_found)
+
+###########
+# Conversions
+###########
+
+def bench_convert(config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        print(f"Converting {config.size} bytes of data")
+        image = load_quiet(sri.SRecordImage, path)
+        stream = srf.SRecordFile.open_streaming(path)
+        for name, source, output in (('image -> bin', image, 'out.bin'),
+                                     ('image -> hex', image, 'out.hex'),
+                                     ('image -> s37', image, 'out.s37'),
+                                     ('stream -> bin', stream, 'out.bin'),
+                                     ('stream -> s37', stream, 'out.s37')):
+            start = time.perf_counter()
+            srcv.convert(source, os.path.join(tmp_dir, output), data_len=64)
+            report('convert', name, time.perf_counter() - start, config.size)
+
+##################
+# Diff of two images
+##################
+
+def bench_diff(config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        old = load_quiet(sri.SRecordImage, path)
+        new = load_quiet(sri.SRecordImage, path)
+        #a few scattered patches
+        rnd = random.Random(0)
+        for sector in rnd.choices(new.sectors, k=100):
+            address = rnd.randint(sector.start, max(sector.start, sector.end - 15))
+            new.write_range(address, bytes(rnd.getrandbits(8) for j in range(min(16, sector.end - address + 1))))
+        print(f"Diff of two {config.size} bytes images")
+        start = time.perf_counter()
+        image_diff = srd.diff_images(old, new)
+        report('diff', 'diff_images', time.perf_counter() - start, config.size, changed=len(image_diff.changed))
+        #every byte inverted
+        inverted = bytes(range(255, -1, -1))
+        for address, data in list(new.iter_sector_data()):
+            new.write_range(address, data.translate(inverted))
+        start = time.perf_counter()
+        image_diff = srd.diff_images(old, new)
+        report('diff', 'fully different', time.perf_counter() - start, config.size, changed=len(image_diff.changed))
+
+##############################
+# Opening a file from the cache
+##############################
+
+def bench_cache(config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        file_size = os.path.getsize(path)
+        src.CACHE_DIR = os.path.join(tmp_dir, 'cache')
+        print(f"Opening a {file_size} bytes file with the cache of parsed images")
+        for file_class in (srf.SRecordFile, sri.SRecordImage):
+            for state in ('miss', 'hit'):
+                start = time.perf_counter()
+                load_quiet(partial(file_class, cache=True), path)
+                report('cache', f"{file_class.__name__} {state}", time.perf_counter() - start, file_size)
+            os.remove(src.cache_path(path, file_class.CACHE_KIND))
+
+###############################
+# Sector remap, gap fill and trim
+###############################
+
+def bench_remap(config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = bench_file(config, tmp_dir)
+        image = load_quiet(sri.SRecordImage, path)
+        sector = largest_sector(image)
+        size = sector.end - sector.start + 1
+        #the sector is moved after the others, on a 16 MiB boundary
+        new_start = (image.higher_addr >> 24) + 1 << 24
+        print(f"Moving, merging and cutting a {size} bytes sector")
+        for name, operation in (('remap', lambda: image.remap_sector(sector.start, new_start)),
+                                ('trim the middle', lambda: image.trim(new_start + size//4, new_start + size//2)),
+                                ('fill the gap', lambda: image.fill_gaps(new_start, new_start + size)),
+                                ('save', image.save)):
+            start = time.perf_counter()
+            operation()
+            report('remap', name, time.perf_counter() - start, size)
+
+##########################################
+# Startup : import time of the SRec modules
+##########################################
+
+#time allowed to import SRec_main in a new interpreter, in ms
+STARTUP_BUDGET = 60
+
+def import_times(module):
+    '''
+    import module in a new interpreter with -X importtime
+    Output : a dictionnary module name -> cumulative import time in ms, the modules
+             imported by the SRec modules are not listed
+    '''
+    env = dict(os.environ)
+    #the bytecode is written by a first import, it is not compiled again each time
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    root = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], cwd=root, env=env,
+                          capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and 'SRec' in line:
+            self_t, cumulative_t, name = line[len('import time:'):].split('|')
+            if name.strip().startswith('SRec'):
+                times[name.strip()] = int(cumulative_t)/1000
+    return times
+
+def bench_import(config, runs = 5):
+    import_times('SRec_main')
+    runs_times = [import_times('SRec_main') for i in range(runs)]
+    print(f"Importing the SRec modules in a new interpreter (best of {runs})")
+    for name in runs_times[0]:
+        best = min(times[name] for times in runs_times)
+        if name == 'SRec_main':
+            report('import', name, best/1000, within_budget=best <= STARTUP_BUDGET)
+        else:
+            report('import', name, best/1000)
+
+BENCHES = {
+    'memory' : bench_memory,
+    'parse' : bench_parse,
+    'lookup' : bench_lookup,
+    'patch' : bench_patch,
+    'write' : bench_write,
+    'parallel' : bench_parallel,
+    'checksum' : bench_checksum,
+    'export' : bench_export,
+    'strings' : bench_strings,
+    'diff' : bench_diff,
+    'cache' : bench_cache,
+    'find' : bench_find,
+    'convert' : bench_convert,
+    'remap' : bench_remap,
+    'import' : bench_import,
+    }
+
+def main():
+    bench_pars = argparse.ArgumentParser(description="Benchmarks of the SRecord tools")
+    bench_pars.add_argument('-s', '--size', help='Number of data bytes of the generated file', type=int, default = 4*2**20)
+    bench_pars.add_argument('-dl', '--data_len', help='Number of data bytes per SRecord', type=int, default = 32)
+    bench_pars.add_argument('-st', '--s_type', help='Type of the data SRecords', choices=list(srcv.DATA_TYPES), default='S3')
+    bench_pars.add_argument('-ns', '--sectors', help='Number of sectors the data is split in', type=int, default = 1)
+    bench_pars.add_argument('-g', '--gaps', help='Hex sizes of the gaps between the sectors, separated by commas (used in turn)', default = '1000')
+    bench_pars.add_argument('-j', '--jobs', help='Maximal number of processes for the parallel benchmarks', type=int, default = os.cpu_count())
+    bench_pars.add_argument('-b', '--bench', help='Benchmark to run (can be repeated), all of them by default', action='append', choices = list(BENCHES))
+    bench_pars.add_argument('--json', help='File where the results are written as JSON')
+    args = bench_pars.parse_args()
+    config = BenchConfig(size=args.size, data_len=args.data_len, s_type=args.s_type, sectors=args.sectors,
+                         gaps=tuple(sr.INT(gap) for gap in args.gaps.split(',')), jobs=args.jobs)
+    for bench in args.bench or BENCHES:
+        try:
+            BENCHES[bench](config)
+        except ValueError as e:
+            bench_pars.error(str(e))
+    if args.json:
+        write_json(args.json, config)
+
+if __name__ == '__main__':
+    main()
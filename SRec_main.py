@@ -1,21 +1,74 @@
 import argparse
+import contextlib
+import io
+import logging
 import shlex
 import SRecord as sr
+import SRecordConvert as srcv
+import SRecordDiff as srd
 import SRecordFile as srf
+import SRecordImage as sri
+import SRecordJournal as srj
+import SRecordQuery as srq
+import SRecordStats as srs
+import SRecordWorkspace as srw
 import os
+import sys
+import time
+import weakref
 
 from collections import namedtuple
+from functools import partial
+from itertools import islice, repeat
 from shutil import copyfile
-from filecmp import cmp
-
-ASCII = list(range(0x30, 0x39)) + list(range(0x41, 0x5a)) + list(range(0x61, 0x7a))
 
 #===========================================================================
-# NamedTuple FuncDef : contains a function, its shortcuts and its arg parser
+# NamedTuple FuncDef : contains a function, its shortcuts and the function
+# building its arg parser (parsers are only built when they are needed)
 #===========================================================================
 
 FuncDef = namedtuple('FuncPrs', ['fnc', 'sct', 'prs'])
 
+#======================================================================
+# Undo/redo journals of the files edited during the session, by file
+# (a journal is dropped with its file)
+#======================================================================
+
+journals = weakref.WeakKeyDictionary()
+
+def journal_of(file):
+    return journals.setdefault(file, srj.Journal())
+
+#======================================================================
+# Workspace : the files open during the session, and their backups
+#======================================================================
+
+workspace = srw.SRecordWorkspace()
+backups = set()
+#no backup is made in batch mode, the files are written once at the end of the script
+make_backups = True
+
+def open_file(path, keep = ()):
+    '''
+    return the SRecordFile object of path, taken from the workspace
+    the backup of the file is made the first time it is opened
+    '''
+    if make_backups and os.path.abspath(path) not in backups:
+        copyfile(path, path + '_bak')
+        backups.add(os.path.abspath(path))
+    return workspace.open(path, keep)
+
+#in batch mode a failing command stops the script, nothing is written (see run_script)
+strict = False
+
+def report_error(error):
+    '''
+    print the error met by a command, or raise it in strict mode
+    '''
+    if strict:
+        raise error
+    print(error)
+
 #=====================================================================
 # Class SubFuncSet to deal with functions names, shortcuts and parsers
 #=====================================================================
@@ -26,32 +79,48 @@ class SubFuncSet():
         self.parser_dict = {}
         self.shortCut_dict = {}
         self.func2shortCut_dict = {}
-    
-    def __getitem__(self, position):
+        #dispatch table : function name -> function
+        self.func_dict = {}
+
+    def name_of(self, position):
+        '''
+        return the function name of a function name or shortcut, None if it is unknown
+        '''
         if position in self.shortCut_dict:
-            return self.parser_dict[self.shortCut_dict[position]]
-        elif position in self.parser_dict :
-            return self.parser_dict[position]
+            return self.shortCut_dict[position]
+        elif position in self.func_dict:
+            return position
         else:
             return None
-    
+
+    def __getitem__(self, position):
+        '''
+        return the parser of a function name or shortcut, built the first time it is asked
+        '''
+        name = self.name_of(position)
+        if name is None:
+            return None
+        if not isinstance(self.parser_dict[name], argparse.ArgumentParser):
+            self.parser_dict[name] = self.parser_dict[name]()
+        return self.parser_dict[name]
+
+    def function(self, position):
+        return self.func_dict[self.name_of(position)]
+
     def __contains__(self, item):
-        if self[item] == None:
-            return False
-        else:
-            return True
+        return self.name_of(item) is not None
 
     def addSubFunc(self, func_def):
         '''
         func_def is a named tuple : 
             func_def.fnc : a function
             func_def.sct : a string to be made as a short cut for func
-            func_def.prs : a parser for the arguments needed for func
+            func_def.prs : a function building the parser for the arguments needed for func
         '''
         self.parser_dict[func_def.fnc.__name__] = func_def.prs
         self.shortCut_dict[func_def.sct] = func_def.fnc.__name__
         self.func2shortCut_dict[func_def.fnc.__name__] = func_def.sct
-        globals()[func_def.sct] = func_def.fnc
+        self.func_dict[func_def.fnc.__name__] = func_def.fnc
 
     def displayHelp(self):
         print("You may chose between the following actions :")
@@ -65,9 +134,12 @@ class SubFuncSet():
 # Defining functions and their argument parsers
 #==============================================
 
-show_line_prs = argparse.ArgumentParser(prog="show_line", description="display the SRecord where is the given adress")
-show_line_prs.add_argument('-a', '--address', help='Hex adress of the data you want to display.No 0x needed')
-show_line_prs.add_argument('-nl', '--nb_lines', help='Number of line to display after the first one', nargs='?', default = 1, type=int)
+def show_line_prs():
+    prs = argparse.ArgumentParser(prog="show_line", description="display the SRecord where is the given adress")
+    prs.add_argument('-a', '--address', help='Hex adress of the data you want to display.No 0x needed')
+    prs.add_argument('-nl', '--nb_lines', help='Number of line to display after the first one', nargs='?', default = 1, type=int)
+    return prs
+
 def show_line(file, address, nb_lines):
     '''
     Display the line containing the address given
@@ -79,19 +151,22 @@ def show_line(file, address, nb_lines):
         line_addr = file.get_data_coord(addr_u).line
     except srf.SRecordFileError as e:
         print("Given adress not found in current file")
-        print(e)
+        report_error(e)
     else :
         for i in range(nb_lines):
             try :
                 print(file.data[line_addr])
-                line_addr += len(file.data[line_addr].data_h)
+                line_addr += len(file.data[line_addr].data)
             except KeyError:
                 print("/!\ - Reaching end of sector.")
 
 
-patch_prs = argparse.ArgumentParser(prog="patch", description="change the data at a given adress with the value given")
-patch_prs.add_argument('-a', '--address', help='Hex adress of the data you want to patch. No 0x needed')
-patch_prs.add_argument('-v', '--value', help='Hex value you want to write')
+def patch_prs():
+    prs = argparse.ArgumentParser(prog="patch", description="change the data at a given adress with the value given")
+    prs.add_argument('-a', '--address', help='Hex adress of the data you want to patch. No 0x needed')
+    prs.add_argument('-v', '--value', help='Hex value you want to write')
+    return prs
+
 def patch(file, address, value):
     '''
     Patching the ADDRESS given with VALUE
@@ -99,91 +174,407 @@ def patch(file, address, value):
                 * address : string of hexadecimal address
                 * value : string of hexadecimal value to patch
     '''
-    file.patch_SRecord_File(address, value)
+    journal_of(file).write_many(file, [srf.hex_patch(address, value)], name=f"patch {address}")
+
 
+def fix_cks_prs():
+    prs = argparse.ArgumentParser(prog='fix_cks', description="parse the current file and update the checksums")
+    return prs
 
-fix_cks_prs = argparse.ArgumentParser(prog='fix_cks', description="parse the current file and update the checksums")
 def fix_cks(file):
     '''
     Compute and patch the checksum of a given SRec file
         Input   * file : SRecordFile object
     '''
-    for srec in file:
-        srec.update_checksum()
-    print("Checksums fixed.\n")
+    edit = journal_of(file).fix_checksums(file)
+    print(f"Checksums fixed, {len(edit.changes)} SRecord(s) updated.\n")
 
 
-apply_prs = argparse.ArgumentParser(prog='apply', description="write the modification done to the file w/o closing it")
+def verify_cks_prs():
+    prs = argparse.ArgumentParser(prog='verify_cks', description="check the checksums of the data SRecords of the current file")
+    return prs
+
+def verify_cks(file):
+    '''
+    Display the lines of a given SRec file having a wrong checksum
+        Input   * file : SRecordFile object
+    '''
+    bad_lines = file.verify_checksums()
+    for line_addr in bad_lines:
+        print(file.data[line_addr])
+    print(f"{len(bad_lines)} data SRecord(s) with a wrong checksum.\n")
+
+
+def apply_prs():
+    prs = argparse.ArgumentParser(prog='apply', description="write the modification done to the file w/o closing it")
+    return prs
+
 def apply(file):
     '''
-    write the changes made to the file
+    write the changes made to the file (only the modified lines are written, see SRecordFile.save)
         Input   * file : SRecordFile object
     '''
-    file.export(file.path)
+    file.save()
 
 
-patch_by_file_prs = argparse.ArgumentParser(prog="patch_by_file", description="patch the current file using data from another file")
-patch_by_file_prs.add_argument('-a', '--address', help='adress of the data you want to patch')
-patch_by_file_prs.add_argument('-pf', '--patching_file', help='SRecord file containing data for patching')
-def patch_by_file(file, address, patching_file):
+def patch_by_file_prs():
+    prs = argparse.ArgumentParser(prog="patch_by_file", description="patch the current file using data from another file")
+    prs.add_argument('-a', '--address', help='adress where the lower address of the patching file is copied (default : its own address)')
+    prs.add_argument('-o', '--offset', help='hex offset added to the addresses of the patching file', default = '0')
+    prs.add_argument('-pf', '--patching_file', help='SRecord file containing data for patching')
+    return prs
+
+def patch_by_file(file, address, offset, patching_file):
     '''
-    Patching the ADDRESS given in dest_f with values from data_f
+    Copy the data of patching_file into file, sector by sector (the gaps of patching_file are kept)
         Input   * file : SRecordFile object
-                * address : string of hexadecimal address
+                * address : string of hexadecimal address, where the data of patching_file begins
+                            if None, the data is copied at its own address plus offset
+                * offset : string of hexadecimal offset (relocation)
                 * patching_file : (string) path to a SRecord file containing data to patch
     '''
-    #Creating data string to patch destination file
-    data = ''
-    srec_data = srf.SRecordFile(patching_file)
-    for line in srec_data:
-        data += ''.join(line.data_h)
-    file.patch_SRecord_File(address, data)
+    start = None if address is None else sr.INT(address)
+    try:
+        writes = srf.overlay_writes(srf.SRecordFile.open_streaming(patching_file), sr.INT(offset), start)
+        journal_of(file).write_many(file, writes, name=f"patch_by_file {patching_file}")
+    except (sr.SRecordError, srf.SRecordFileError, OSError) as e:
+        report_error(e)
+    else:
+        print(f"{sum(len(data) for addr, data in writes)} bytes patched.")
 
 
-change_working_file_prs = argparse.ArgumentParser(prog="change_working_file", description="save the current file and open a new one")
-change_working_file_prs.add_argument('-f', '--file', help = 'new file to load and work on')
+def change_working_file_prs():
+    prs = argparse.ArgumentParser(prog="change_working_file", description="work on another file, the current one stays open")
+    prs.add_argument('-f', '--file', help = 'file to work on, loaded if it is not open yet')
+    return prs
+
 def change_working_file(old_file, file):
     '''
-    Change the working file, after saving and closing the current one.
-        Input   * old_file : SRecordFile object to save and close
+    Change the working file. The current one stays open in the workspace with its
+    changes, it is saved when it is dropped from the workspace or when leaving.
+        Input   * old_file : SRecordFile object
                 * file : (string) path to a SRecord file to work on
     /!\ old_file is a SRecordFile object while file is a path string
     '''
-    old_file.export(old_file.path)
-    if cmp(old_file.path, old_file.path + '_bak'):
-        os.remove(old_file.path + '_bak')  
-    copyfile(file, file + '_bak')
-    return srf.SRecordFile(file)
-
-strings_prs = argparse.ArgumentParser(prog="strings", description="print strings found in the SRecordFile")
-strings_prs.add_argument('-m', '--min_len', help = 'minimal lengh requiered to print a string', nargs='?', default = 3)
-def strings(file, min_len):
+    try:
+        return open_file(file)
+    except (sr.SRecordError, srf.SRecordFileError, OSError) as e:
+        report_error(e)
+        return old_file
+
+
+def copy_prs():
+    prs = argparse.ArgumentParser(prog="copy", description="copy a range of data from an open file to another one")
+    prs.add_argument('-a', '--address', help='Hex address of the range to copy')
+    prs.add_argument('-s', '--size', help='Hex size of the range to copy')
+    prs.add_argument('-d', '--dest_address', help='Hex address where the range is copied (default : the same address)')
+    prs.add_argument('-sf', '--source_file', help='file the range is copied from (default : the current file)')
+    prs.add_argument('-df', '--dest_file', help='file the range is copied to (default : the current file)')
+    return prs
+
+def copy(file, address, size, dest_address, source_file, dest_file):
+    '''
+    Copy a range of data between two files of the workspace, as one buffer
+        Input   * file : SRecordFile object, the current file
+                * address, size : strings of hexadecimal address and size of the range to copy
+                * dest_address : string of hexadecimal address where the range is copied
+                                 if None, the range is copied at the same address
+                * source_file, dest_file : (string) paths to the SRecord files to copy from and to
+                                           if None, the current file is used
+    '''
+    address = sr.INT(address)
+    dest_address = address if dest_address is None else sr.INT(dest_address)
+    try:
+        source = file if source_file is None else open_file(source_file, keep=[file])
+        dest = file if dest_file is None else open_file(dest_file, keep=[file, source])
+        data = source.read_range(address, sr.INT(size))
+        journal_of(dest).write_many(dest, [(dest_address, data)], name=f"copy from {source.name}")
+    except (sr.SRecordError, srf.SRecordFileError, OSError) as e:
+        report_error(e)
+    else:
+        print(f"{len(data)} bytes copied from {source.name} to {dest.name}.")
+
+
+def list_files_prs():
+    prs = argparse.ArgumentParser(prog="list_files", description="list the files open in the workspace")
+    return prs
+
+def list_files(file):
     '''
-    Display all the ascii strings longer than 2 chars found in the file
+    Display the files of the workspace, the current one being marked with a *
+        Input   * file : SRecordFile object, the current file
+    '''
+    for image in workspace:
+        changes = ", unsaved changes" if image.has_changes() else ""
+        print(f"{'*' if image is file else ' '} {image.path} : {image.footprint()/2**20:.1f} MiB{changes}")
+    print(f"{workspace.footprint()/2**20:.1f} MiB used out of {workspace.budget/2**20:.0f} MiB.")
+
+def strings_prs():
+    prs = argparse.ArgumentParser(prog="strings", description="print strings found in the SRecordFile")
+    prs.add_argument('-m', '--min_len', help = 'minimal lengh requiered to print a string', nargs='?', default = 3)
+    prs.add_argument('-c', '--charset', help = 'characters a string is made of (default : numbers and letters)', choices = list(srq.CHARSETS), default = 'alnum')
+    return prs
+
+def strings(file, min_len, charset):
+    '''
+    Display all the strings longer than min_len chars found in the file, with their address
         Insput  * file : SRecordFile object in which the search is performed
+                * min_len : minimal length of a string
+                * charset : class of characters a string is made of :
+                    alnum   : 0x30 - 0x39 for numbers, 0x41 - 0x5A and 0x61 - 0x7A for letters
+                    ascii   : 0x20 - 0x7E, printable ASCII
+                    utf16le : printable ASCII stored on two bytes (little endian)
     '''
-    # low acceptance for ASCII. Will only consider numbers and letters.
-    # i.e : 0x30 - 0x39 for numbers
-    #       0x41 - 0x5A for upper case
-    #       0x61 - 0x7A for lower case
+    for address, detected_string in srq.iter_strings(file, int(min_len), charset):
+        print(f"0x{file.addrFormat.format(address)} : {detected_string}")
 
-    min_len = int(min_len)
 
-    detected_string = ''
-    all_data = []
-    for addr in file.data:
-        all_data += file.data[addr].data_u
-    
+def diff_prs():
+    prs = argparse.ArgumentParser(prog="diff", description="compare the current file with another one, address by address")
+    prs.add_argument('-f', '--file', dest='other_file', help = 'SRecord file to compare the current file with')
+    prs.add_argument('-nr', '--nb_ranges', help = 'maximal number of ranges to display for each kind of difference', nargs='?', default = 20, type=int)
+    return prs
 
-    for byte in all_data:
-        if byte in ASCII:
-            detected_string += chr(byte)
-        else :
-            if len(detected_string) >= min_len:
-                print(detected_string)
-                detected_string = ""
-            else:
-                detected_string = ""
+def diff(file, other_file, nb_ranges):
+    '''
+    Display the differences between file and other_file : changed, added and removed ranges
+        Input   * file : SRecordFile object (the old image)
+                * other_file : (string) path to the SRecord file to compare with (the new image)
+                * nb_ranges : maximal number of ranges displayed for each kind of difference
+    '''
+    try:
+        image_diff = srd.diff_images(file, sri.SRecordImage(other_file))
+    except (sr.SRecordError, srf.SRecordFileError, OSError) as e:
+        report_error(e)
+        return
+    for kind in ('changed', 'added', 'removed'):
+        ranges = getattr(image_diff, kind)
+        print(f"{len(ranges)} range(s) {kind}, {getattr(image_diff, kind + '_bytes')} bytes")
+        for sector in ranges[:nb_ranges]:
+            print(f"\t0x{file.addrFormat.format(sector.start)} - 0x{file.addrFormat.format(sector.end)}")
+        if len(ranges) > nb_ranges:
+            print("\t...")
+
+
+def undo_prs():
+    prs = argparse.ArgumentParser(prog="undo", description="undo the last patch, patch_by_file or fix_cks")
+    return prs
+
+def undo(file):
+    '''
+    Undo the last edit done on the file
+        Input   * file : SRecordFile object
+    '''
+    edit = journal_of(file).undo(file)
+    print(f"Undone : {edit}" if edit else "Nothing to undo.")
+
+
+def redo_prs():
+    prs = argparse.ArgumentParser(prog="redo", description="redo the last edit undone")
+    return prs
+
+def redo(file):
+    '''
+    Redo the last edit undone on the file
+        Input   * file : SRecordFile object
+    '''
+    edit = journal_of(file).redo(file)
+    print(f"Redone : {edit}" if edit else "Nothing to redo.")
+
+
+def read_prs():
+    prs = argparse.ArgumentParser(prog="read", description="display the data of an address range, whatever the SRecords it is in")
+    prs.add_argument('-a', '--address', help='Hex address of the range')
+    prs.add_argument('-s', '--size', help='Hex size of the range', default = '10')
+    prs.add_argument('-fb', '--fill_byte', help='Hex byte displayed in the gaps between sectors (by default a gap is an error)')
+    return prs
+
+def read(file, address, size, fill_byte):
+    '''
+    Display the data of a range as an hexadecimal string (usable as a patch value)
+        Input   * file : SRecordFile object
+                * address, size : strings of hexadecimal address and size of the range
+                * fill_byte : string of hexadecimal byte used in the gaps, None to refuse gaps
+    '''
+    try:
+        data = srq.read(file, sr.INT(address), sr.INT(size), None if fill_byte is None else sr.INT(fill_byte))
+    except (srq.QueryError, srf.SRecordFileError) as e:
+        report_error(e)
+    else:
+        print(data.hex().upper())
+
+
+def find_prs():
+    prs = argparse.ArgumentParser(prog="find", description="find the addresses of a byte pattern")
+    prs.add_argument('-p', '--pattern', help="Hex bytes to look for, '?' matching any digit (e.g. DEAD??EF)")
+    prs.add_argument('-n', '--nb_results', help='maximal number of addresses to display', nargs='?', default = 20, type=int)
+    return prs
+
+def find(file, pattern, nb_results):
+    '''
+    Display the addresses where pattern is found
+        Input   * file : SRecordFile object
+                * pattern : string of hexadecimal bytes, '?' standing for any digit
+                * nb_results : maximal number of addresses displayed
+    '''
+    try:
+        addresses = list(islice(srq.find(file, *srq.parse_pattern(pattern)), nb_results + 1))
+    except srq.QueryError as e:
+        report_error(e)
+        return
+    for address in addresses[:nb_results]:
+        print(f"0x{file.addrFormat.format(address)}")
+    if len(addresses) > nb_results:
+        print("\t...")
+    print(f"{min(len(addresses), nb_results)} occurrence(s) displayed.")
+
+
+def hexdump_prs():
+    prs = argparse.ArgumentParser(prog="hexdump", description="display an address range as an hexadecimal dump")
+    prs.add_argument('-a', '--address', help='Hex address of the range')
+    prs.add_argument('-s', '--size', help='Hex size of the range', default = '100')
+    prs.add_argument('-w', '--width', help='number of bytes per line', nargs='?', default = 16, type=int)
+    return prs
+
+def hexdump(file, address, size, width):
+    '''
+    Display the hexadecimal dump of a range, the gaps between sectors are displayed as '--'
+        Input   * file : SRecordFile object
+                * address, size : strings of hexadecimal address and size of the range
+                * width : number of bytes per line
+    '''
+    for line in srq.hexdump(file, sr.INT(address), sr.INT(size), width):
+        print(line)
+
+
+def convert_prs():
+    prs = argparse.ArgumentParser(prog="convert", description="write the current file as a binary image, an Intel HEX file or re-blocked SRecords")
+    prs.add_argument('-o', '--output', help='file to write, its format is found from its extension (.bin, .hex, .s19/.s28/.s37...)')
+    prs.add_argument('-of', '--out_format', help='format of the output file, if its extension is not enough', choices=['srec', 'ihex', 'bin'])
+    prs.add_argument('-fb', '--fill_byte', help='Hex byte written in the gaps of a binary image', default='FF')
+    prs.add_argument('-dl', '--data_len', help='number of data bytes per record', type=int)
+    prs.add_argument('-st', '--s_type', help='type of the data SRecords (default : the smallest one)', choices=list(srcv.DATA_TYPES))
+    prs.add_argument('--align', help='records start at multiples of data_len', action='store_true')
+    return prs
+
+def convert(file, output, out_format, fill_byte, data_len, s_type, align):
+    '''
+    Write the data of the file (its current state) into another format
+        Input   * file : SRecordFile object
+                * output : (string) path of the file to write
+                * out_format : 'srec', 'ihex' or 'bin', None to use the extension of output
+                * fill_byte : string of hexadecimal byte written in the gaps of a binary image
+                * data_len, s_type, align : layout of the records written (see SRecordConvert)
+    '''
+    try:
+        srcv.convert(file, output, out_format, sr.INT(fill_byte), data_len, s_type, align)
+    except srcv.ConvertError as e:
+        report_error(e)
+    else:
+        print(f"{file.name} written into {output}.")
+
+
+def as_image(file):
+    '''
+    return the SRecordImage of file, built from it and put in the workspace in its
+    place if it is an SRecordFile : sectors are moved, merged or cut as whole buffers
+    The journal of the file is dropped, its edits don't match the new layout.
+    '''
+    journals.pop(file, None)
+    if isinstance(file, sri.SRecordImage):
+        return file
+    return workspace.replace(sri.SRecordImage.from_file(file))
+
+
+def remap_sector_prs():
+    prs = argparse.ArgumentParser(prog="remap_sector", description="move a whole sector to a new base address (can't be undone)")
+    prs.add_argument('-s', '--sector', help='Hex start address of the sector to move')
+    prs.add_argument('-n', '--new_start', help='Hex address where the sector starts after the move')
+    return prs
+
+def remap_sector(file, sector, new_start):
+    '''
+    Move a sector, the address type of its SRecords is widened if needed
+        Input   * file : SRecordFile object
+                * sector, new_start : strings of hexadecimal addresses
+        Output  * the SRecordImage the file became (see as_image)
+    '''
+    image = as_image(file)
+    try:
+        image.remap_sector(sr.INT(sector), sr.INT(new_start))
+    except srf.SRecordFileError as e:
+        report_error(e)
+    else:
+        print(f"Sector 0x{sr.INT(sector):X} moved to 0x{sr.INT(new_start):X}.")
+    return image
+
+
+def fill_gaps_prs():
+    prs = argparse.ArgumentParser(prog="fill_gaps", description="merge the sectors of a range, the gaps between them are filled (can't be undone)")
+    prs.add_argument('-a', '--address', help='Hex start address of the range', default='0')
+    prs.add_argument('-e', '--end', help='Hex end address of the range (included)', default='FFFFFFFF')
+    prs.add_argument('-fb', '--fill_byte', help='Hex byte written in the gaps', default='FF')
+    prs.add_argument('-dl', '--data_len', help='number of data bytes of the SRecords added (default : the one of the SRecord before the gap)', type=int)
+    return prs
+
+def fill_gaps(file, address, end, fill_byte, data_len):
+    '''
+    Fill the gaps between the sectors found between address and end
+        Input   * file : SRecordFile object
+                * address, end, fill_byte : strings of hexadecimal values
+                * data_len : number of data bytes of the SRecords added, None for the default
+        Output  * the SRecordImage the file became (see as_image)
+    '''
+    image = as_image(file)
+    try:
+        print(f"{image.fill_gaps(sr.INT(address), sr.INT(end), sr.INT(fill_byte), data_len)} bytes added.")
+    except srf.SRecordFileError as e:
+        report_error(e)
+    return image
+
+
+def trim_prs():
+    prs = argparse.ArgumentParser(prog="trim", description="remove the data of an address range, SRecords are cut at its bounds (can't be undone)")
+    prs.add_argument('-a', '--address', help='Hex start address of the range')
+    prs.add_argument('-e', '--end', help='Hex end address of the range (included)')
+    return prs
+
+def trim(file, address, end):
+    '''
+    Remove the data found between address and end
+        Input   * file : SRecordFile object
+                * address, end : strings of hexadecimal addresses
+        Output  * the SRecordImage the file became (see as_image)
+    '''
+    image = as_image(file)
+    try:
+        print(f"{image.trim(sr.INT(address), sr.INT(end))} bytes removed.")
+    except srf.SRecordFileError as e:
+        report_error(e)
+    return image
+
+
+def stats_prs():
+    prs = argparse.ArgumentParser(prog="stats", description="display the counters and timers of the operations done (see SRecordStats)")
+    prs.add_argument('-on', '--enable', help='start recording statistics', action='store_true')
+    prs.add_argument('-off', '--disable', help='stop recording statistics', action='store_true')
+    prs.add_argument('-r', '--reset', help='reset the statistics after displaying them', action='store_true')
+    return prs
+
+def stats(file, enable, disable, reset):
+    '''
+    Display the statistics recorded : bytes read and written, SRecords parsed,
+    lookups, bisect calls, checksums computed, time spent loading and saving
+        Input   * file : SRecordFile object (not used)
+                * enable, disable : start or stop recording (booleans)
+                * reset : clear the statistics once displayed (boolean)
+    '''
+    if enable or disable:
+        srs.stats.enable(enable)
+        print(f"Statistics {'enabled' if enable else 'disabled'}.")
+    print(srs.stats.report())
+    if reset:
+        srs.stats.reset()
 
 
 #Initializing our sub_func_set that will contains links between functions, their shortcuts and their parsers
@@ -193,10 +584,170 @@ sub_func_set = SubFuncSet()
 sub_func_set.addSubFunc(FuncDef(fnc=show_line, sct='sl', prs=show_line_prs))
 sub_func_set.addSubFunc(FuncDef(fnc=patch, sct='p', prs=patch_prs))
 sub_func_set.addSubFunc(FuncDef(fnc=fix_cks, sct='fc', prs=fix_cks_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=verify_cks, sct='vc', prs=verify_cks_prs))
 sub_func_set.addSubFunc(FuncDef(fnc=apply, sct='a', prs=apply_prs))
 sub_func_set.addSubFunc(FuncDef(fnc=patch_by_file, sct='pbf', prs=patch_by_file_prs))
 sub_func_set.addSubFunc(FuncDef(fnc=change_working_file, sct='cwf', prs=change_working_file_prs))
 sub_func_set.addSubFunc(FuncDef(fnc=strings, sct='s', prs=strings_prs ))
+sub_func_set.addSubFunc(FuncDef(fnc=diff, sct='d', prs=diff_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=undo, sct='u', prs=undo_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=redo, sct='r', prs=redo_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=copy, sct='cp', prs=copy_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=list_files, sct='lf', prs=list_files_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=read, sct='rd', prs=read_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=find, sct='fd', prs=find_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=hexdump, sct='hd', prs=hexdump_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=convert, sct='cv', prs=convert_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=remap_sector, sct='rs', prs=remap_sector_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=fill_gaps, sct='fg', prs=fill_gaps_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=trim, sct='tr', prs=trim_prs))
+sub_func_set.addSubFunc(FuncDef(fnc=stats, sct='st', prs=stats_prs))
+
+def run_command(file, command, options):
+    '''
+    Parse the options of command and run it on file
+    Output : the file to work on after the command (file, unless the command returns another one)
+    /!\ a SystemExit is raised when the options are invalid or when the help is asked
+    '''
+    arguments = sub_func_set[command].parse_args(options)
+    ret = sub_func_set.function(command)(file, **vars(arguments))
+    #The functions returning a file (change_working_file, remap_sector...) change the working file
+    return ret if isinstance(ret, srf.SRecordFile) else file
+
+#####################################################
+# Batch validation : no prompt, the files are checked
+#####################################################
+
+def validate_batch(paths, jobs):
+    '''
+    Validate the SRecord files given, using jobs processes
+    Output : the number of invalid files
+    '''
+    start = time.perf_counter()
+    results = srf.validate_files(paths, jobs)
+    nb_invalid = 0
+    for path, errors in results.items():
+        if errors:
+            nb_invalid += 1
+            print(f"{path} : {len(errors)} error(s)")
+            for line_nb, error in errors:
+                print(f"\tline {line_nb} : {error}")
+        else:
+            print(f"{path} : OK")
+    print(f"{len(paths)} file(s) validated in {time.perf_counter() - start:.2f} s, {nb_invalid} invalid.")
+    return nb_invalid
+
+##################################################################
+# Batch mode : a script of commands is run on each file, no prompt
+##################################################################
+
+def read_script(script, commands):
+    '''
+    return the command lines of the script file (empty lines and lines starting
+    with # are skipped) followed by commands
+    '''
+    lines = []
+    if script is not None:
+        with open(script) as script_f:
+            lines = [line.strip() for line in script_f]
+    return [line for line in lines if line and not line.startswith('#')] + list(commands)
+
+def list_batch_files(paths):
+    '''
+    return the files of paths, a directory being replaced by the SRecord files it holds
+    '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if srcv.FORMATS.get(os.path.splitext(name)[1].lower()) == 'srec')
+        else:
+            files.append(path)
+    return files
+
+def run_script(path, lines, loader):
+    '''
+    Load the file at path once, run every command line on it in memory, then write
+    each file changed once (no backup is made). Nothing is written if a command fails,
+    including the commands which only print their errors in the prompt (strict mode).
+    Output : (output of the commands, timings (load, commands, save) in seconds, error or None)
+    '''
+    global make_backups, strict
+    make_backups = False
+    strict = True
+    workspace.loader = loader
+    output = io.StringIO()
+    timings = [0, 0, 0]
+    error = None
+    start = time.perf_counter()
+    try:
+        file = open_file(path)
+        timings[0] = time.perf_counter() - start
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            for line in lines:
+                options = shlex.split(line, posix=0)
+                command = options.pop(0).lower()
+                if command not in sub_func_set:
+                    raise srf.SRecordFileError(f"{command} : unknown command")
+                try:
+                    file = run_command(file, command, options)
+                except SystemExit:
+                    raise srf.SRecordFileError(f"{line} : invalid arguments")
+        timings[1] = time.perf_counter() - start - timings[0]
+        for key in list(workspace.images):
+            workspace.close(key)
+        timings[2] = time.perf_counter() - start - timings[0] - timings[1]
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        #the changes are dropped, the files stay as they were
+        workspace.images.clear()
+    return output.getvalue(), timings, error
+
+def run_batch(paths, lines, loader, jobs):
+    '''
+    Run the command lines on each file (or SRecord file of a directory) of paths,
+    the files being spread over jobs processes
+    Output : the number of files on which the script failed
+    '''
+    start = time.perf_counter()
+    files = list_batch_files(paths)
+    if jobs > 1 and len(files) > 1:
+        with srf.process_pool(jobs) as executor:
+            results = list(executor.map(run_script, files, repeat(lines), repeat(loader)))
+    else:
+        results = [run_script(path, lines, loader) for path in files]
+    nb_failed = 0
+    for path, (output, timings, error) in zip(files, results):
+        load_t, commands_t, save_t = (f"{timing*1000:.1f}" for timing in timings)
+        if error is None:
+            print(f"{path} : OK (load {load_t} ms, commands {commands_t} ms, save {save_t} ms)")
+        else:
+            nb_failed += 1
+            print(f"{path} : FAILED, {error}")
+        for line in output.splitlines():
+            print(f"\t{line}")
+    print(f"{len(files)} file(s) processed in {time.perf_counter() - start:.2f} s, {nb_failed} failed.")
+    return nb_failed
+
+###########################################################
+# Profiling : a whole session is run under cProfile
+###########################################################
+
+def profile_session(session, args, dump_name, nb_functions = 25):
+    '''
+    Run session(args) under cProfile, then print its hottest functions (by time
+    spent in the function itself) and write the raw statistics in dump_name if given
+    '''
+    #only imported when profiling, to keep the startup fast
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(session, args)
+    finally:
+        if dump_name:
+            profiler.dump_stats(dump_name)
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats('tottime').print_stats(nb_functions)
 
 #######################################
 # Main function : entry point for SRec 
@@ -206,20 +757,64 @@ def main():
     #Init_pars get the argv array from the command line.
     #It expects a file given as argument
     init_pars = argparse.ArgumentParser(description="Load a SRecord file to work with")
-    init_pars.add_argument('-f', '--file', help='File Name')
+    init_pars.add_argument('-f', '--file', help='File Name (in batch mode, files and directories, whose SRecord files are processed)', nargs='+')
+    init_pars.add_argument('-i', '--image', help='Load the file as a flat memory image (faster patching of large ranges)', action='store_true')
+    init_pars.add_argument('-l', '--lazy', help='Only index the file, SRecords are parsed when accessed (faster opening of large files)', action='store_true')
+    init_pars.add_argument('-j', '--jobs', help='Number of processes used to parse or validate the files', type=int, default=1)
+    init_pars.add_argument('-v', '--validate', help='Validate the given files and exit, no prompt', nargs='+', metavar='FILE')
+    init_pars.add_argument('--cache', help='Keep the parsed files in a cache (see SRecordCache) : opening them again is much faster', action='store_true')
+    init_pars.add_argument('-mb', '--memory_budget', help='Memory budget (MiB) of the files kept open at the same time', type=int, default=srw.DEFAULT_BUDGET >> 20)
+    init_pars.add_argument('-c', '--command', help='Command to run on each file, no prompt (can be repeated, run after the script)', action='append', default=[])
+    init_pars.add_argument('-s', '--script', help='File of commands to run on each file, one per line, no prompt')
+    init_pars.add_argument('--stats', help='Record statistics of the operations from the start (see the stats command)', action='store_true')
+    init_pars.add_argument('--profile', help='Run the session under cProfile and print the hottest functions, the raw statistics are written in the file given', nargs='?', const='', metavar='FILE')
 
     #We use the object ini_pars to parse the command line arguments
     args = init_pars.parse_args()
+    if (args.command or args.script) and not args.file:
+        init_pars.error("-c/--command and -s/--script need the files to run on (-f/--file)")
+    if not args.validate and not args.file:
+        init_pars.error("a file to work with is needed (-f/--file)")
+    srs.stats.enable(args.stats)
+    if args.profile is None:
+        run(args)
+    else:
+        profile_session(run, args, args.profile)
+
+def run(args):
+    '''
+    Run the session asked by the command line arguments (see main)
+    '''
+    #In validation mode, the exit status is the number of invalid files
+    if args.validate:
+        sys.exit(min(validate_batch(args.validate, args.jobs), 255))
+
+    #every file of the session is loaded with the same backend
+    if args.image:
+        workspace.loader = partial(sri.SRecordImage, workers=args.jobs, cache=args.cache)
+    else:
+        workspace.loader = partial(srf.SRecordFile, lazy=args.lazy, workers=args.jobs, cache=args.cache)
+    workspace.budget = args.memory_budget << 20
+
+    #In batch mode, the exit status is the number of files on which the script failed
+    #(with several processes, each file is parsed by one process)
+    if args.command or args.script:
+        loader = workspace.loader
+        if args.jobs > 1 and len(args.file) > 1 or any(os.path.isdir(path) for path in args.file):
+            loader = partial(loader, workers=1)
+        sys.exit(min(run_batch(args.file, read_script(args.script, args.command), loader, args.jobs), 255))
+
+    #the loading messages are printed in the prompt
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
 
     #from it we get the "file" argument and use it to open the file
-    copyfile(args.file, args.file + '_bak')
-    SRec_f = srf.SRecordFile(args.file)
+    SRec_f = open_file(args.file[0])
 
     command = ''
 
     while command not in ["quit", "q", "exit", "ciao"]:
         #We use input to get a string from the user, that will be formated as a call to a script
-        command = input("\033[0;91m {}\033[00m".format(SRec_f.name + ">"))
+        command = input(sr.colorize(f" {SRec_f.name}>", '0;91'))
 
         #We cut this string into arguments using spaces
         options = shlex.split(command, posix=0) #posix=0 retains backslashes in Windows paths
@@ -232,28 +827,24 @@ def main():
             continue
 
         #If the command given is in the parsers dictionnary, we apply its parser to the options
-        #Then we gives the result to the correct function (the command string is evaluated which trigger the function itself)
+        #Then we gives the result to the correct function, found in the dispatch table of sub_func_set
         if command in sub_func_set:
             try:
-                arguments = sub_func_set[command].parse_args(options)
-                ret = eval(command)(SRec_f, **vars(arguments))
-                #The only function to return anything is the change_working_file() one, meaning we want to update SRec_f
-                if type(ret) == srf.SRecordFile:
-                    SRec_f = ret
+                SRec_f = run_command(SRec_f, command, options)
             except SystemExit:
                 #In case we get a SystemExit, it's raised by the function parser.
                 #We then show the function parser help message and keep running
                 #This is to avoid the exit usually called when asking for -h
                 pass
 
-        #Various ways to exit, if the file has not changed, we suppress its backup
+        #Various ways to exit, the backups of the files never written are suppressed
         elif command in ["quit", "q", "exit", "ciao"]:
             print("\n ############")
             print(" Ciao bella !")
             print(" ############")
-            SRec_f.export(SRec_f.path)
-            if cmp(SRec_f.path, SRec_f.path + '_bak'):
-                os.remove(SRec_f.path + '_bak')
+            workspace.save_all()
+            for path in backups - workspace.modified_paths():
+                os.remove(path + '_bak')
         elif command in ["-h", "--help", "help", "h"]:
             sub_func_set.displayHelp()
         else:
@@ -0,0 +1,145 @@
+import SRecord as sr
+import collections
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from array import array
+
+#########################################################################
+# On-disk cache of parsed images : opening a file already parsed once
+# copies its buffers from the cache instead of parsing every line again
+#########################################################################
+
+#directory of the cache files, can be set with the SREC_CACHE_DIR environment variable
+CACHE_DIR = os.environ.get('SREC_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'SRecord'))
+
+#Everything needed to rebuild an SRecordFile or an SRecordImage without parsing :
+#   * header, footer : lists of SRecords
+#   * sectors : list of (start, end), in file order
+#   * line_addrs, line_offsets : array('Q') of the address and offset in the file of
+#     each data line, in address order
+#   * line_lens, line_types, line_cks : data length, type ('1', '2' or '3') and
+#     checksum of each data line, one byte per line
+#   * seg_starts, segments : start addresses and data of the ranges of contiguous data
+ImageLayout = collections.namedtuple('ImageLayout', ['header', 'footer', 'sectors',
+                                                     'line_addrs', 'line_offsets', 'line_lens', 'line_types', 'line_cks',
+                                                     'seg_starts', 'segments'])
+
+#Cache file :
+#   magic, digest of the source file, number of lines, segments, sectors and headers,
+#   size of the header and footer text, followed by (integers are 8 bytes, little endian)
+#   line_addrs, line_offsets, seg_starts, segment lengths, sectors (start, end),
+#   line_lens, line_types, line_cks, header and footer lines ("offset line\n"),
+#   and the data of the segments, one after the other
+MAGIC = b'SRECIMG1'
+CACHE_HEADER = struct.Struct('<8s16sQQQQQ')
+
+def cache_path(path, kind, cache_dir = None):
+    '''
+    return the path of the cache file of the SRecord file at path : there is one
+    cache file per source file and per kind of layout, overwritten when the source
+    file changes. kind is the layout stored (the SRecordFile and SRecordImage loaders
+    lay the lines out differently, see their CACHE_KIND)
+    '''
+    name = hashlib.blake2b(f"{kind}:{os.path.abspath(path)}".encode('utf-8'), digest_size=16).hexdigest()
+    return os.path.join(cache_dir or CACHE_DIR, name + '.srimg')
+
+def write_array(cache_f, typecode, values):
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    cache_f.write(values)
+
+def read_array(view, pos, typecode, nb):
+    '''
+    Output : the array of nb values read at pos in view, the position after it
+    '''
+    values = array(typecode)
+    end = pos + nb*values.itemsize
+    values.frombytes(view[pos:end])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, end
+
+def write_cache(path, kind, digest, layout, cache_dir = None):
+    '''
+    Write the ImageLayout of the SRecord file at path, whose content digest is digest
+    (see SRecordFile.file_digest), in its cache file for kind (see cache_path). The file
+    is written aside and then replaces the former one, a reader never sees a partial
+    cache file.
+    '''
+    name = cache_path(path, kind, cache_dir)
+    os.makedirs(os.path.dirname(name), exist_ok=True)
+    others = ''.join(f"{srec.offset} {srec.to_string()}\n" for srec in layout.header + layout.footer).encode('ascii')
+    tmp_fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(name))
+    try:
+        with os.fdopen(tmp_fd, 'wb') as cache_f:
+            cache_f.write(CACHE_HEADER.pack(MAGIC, bytes.fromhex(digest), len(layout.line_addrs), len(layout.segments),
+                                            len(layout.sectors), len(layout.header), len(others)))
+            write_array(cache_f, 'Q', layout.line_addrs)
+            write_array(cache_f, 'Q', layout.line_offsets)
+            write_array(cache_f, 'Q', layout.seg_starts)
+            write_array(cache_f, 'Q', map(len, layout.segments))
+            write_array(cache_f, 'Q', (bound for sector in layout.sectors for bound in sector))
+            cache_f.write(layout.line_lens)
+            cache_f.write(layout.line_types)
+            cache_f.write(layout.line_cks)
+            cache_f.write(others)
+            for segment in layout.segments:
+                cache_f.write(segment)
+        os.replace(tmp_name, name)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+
+def read_cache(path, kind, digest, cache_dir = None):
+    '''
+    Read the cache file of the SRecord file at path for kind (see cache_path), the file
+    is mapped in memory and each buffer is copied out of it at once
+    Output : the ImageLayout of the file, None if there is no cache file or if it does
+             not match digest (the content of the file changed since it was cached)
+    '''
+    try:
+        with open(cache_path(path, kind, cache_dir), 'rb') as cache_f:
+            buffer = mmap.mmap(cache_f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    with buffer, memoryview(buffer) as view:
+        try:
+            if len(view) < CACHE_HEADER.size:
+                return None
+            magic, cached_digest, nb_lines, nb_segments, nb_sectors, nb_header, others_len = CACHE_HEADER.unpack_from(view)
+            if magic != MAGIC or cached_digest.hex() != digest:
+                return None
+            pos = CACHE_HEADER.size
+            line_addrs, pos = read_array(view, pos, 'Q', nb_lines)
+            line_offsets, pos = read_array(view, pos, 'Q', nb_lines)
+            seg_starts, pos = read_array(view, pos, 'Q', nb_segments)
+            seg_lens, pos = read_array(view, pos, 'Q', nb_segments)
+            bounds, pos = read_array(view, pos, 'Q', 2*nb_sectors)
+            line_lens, pos = read_array(view, pos, 'B', nb_lines)
+            line_types = bytearray(view[pos:pos + nb_lines])
+            line_cks = bytes(view[pos + nb_lines:pos + 2*nb_lines])
+            pos += 2*nb_lines
+            others = []
+            for line in bytes(view[pos:pos + others_len]).decode('ascii').splitlines():
+                offset, srec = line.split(' ')
+                others.append(sr.SRecord(srec, int(offset)))
+            pos += others_len
+            if pos + sum(seg_lens) != len(view):
+                return None
+            segments = []
+            for length in seg_lens:
+                segments.append(bytearray(view[pos:pos + length]))
+                pos += length
+        except (ValueError, struct.error, sr.SRecordError):
+            #truncated or corrupted cache file
+            return None
+    return ImageLayout(header=others[:nb_header], footer=others[nb_header:],
+                       sectors=list(zip(bounds[::2], bounds[1::2])),
+                       line_addrs=line_addrs, line_offsets=line_offsets, line_lens=line_lens,
+                       line_types=line_types, line_cks=line_cks, seg_starts=list(seg_starts), segments=segments)
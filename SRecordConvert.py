@@ -0,0 +1,327 @@
+import argparse
+import SRecord as sr
+import SRecordFile as srf
+import os
+
+from functools import partial
+
+#############################################################################
+# Conversions between SRecord files, raw binary images and Intel HEX files.
+# Every format is read and written as a sequence of (address, data) pieces of
+# contiguous data (see iter_sector_data), never as a list of records.
+#############################################################################
+
+class ConvertError(Exception):
+    pass
+
+#data SRecord types by address length, and the footer type of each one
+DATA_TYPES = ('S1', 'S2', 'S3')
+FOOTER_OF = {'S1':'S9', 'S2':'S8', 'S3':'S7'}
+
+#size of the pieces read from binary and Intel HEX files
+PIECE_SIZE = 1 << 20
+
+def iter_lines_cuts(address, length, data_len, align = False, boundary = None):
+    '''
+    Generator of (offset, size) of the lines a piece of data is cut into
+        Input   * address, length : start address and length of the piece
+                * data_len : maximal number of data bytes per line
+                * align : if set, lines start at multiples of data_len (but the first one)
+                * boundary : if given, a line never goes over a multiple of boundary
+    '''
+    offset = 0
+    while offset < length:
+        size = min(data_len, length - offset)
+        crt_addr = address + offset
+        if align:
+            size = min(size, data_len - crt_addr%data_len)
+        if boundary is not None:
+            size = min(size, boundary - crt_addr%boundary)
+        yield offset, size
+        offset += size
+
+def smallest_type(higher_addr):
+    '''
+    return the data SRecord type with the shortest address able to hold higher_addr
+    '''
+    for s_type in DATA_TYPES:
+        if higher_addr < 1 << 8*sr.SRecord.ADDR_LEN[s_type]:
+            return s_type
+    raise ConvertError(f"Address 0x{higher_addr:X} is too high for an SRecord")
+
+#################
+# SRecord output
+#################
+
+def write_srec(pieces, name, s_type = 'S3', data_len = 32, headers = (), entry = 0, align = False):
+    '''
+    Write pieces of data into an SRecord file
+        Input   * pieces : iterable of (address, data)
+                * s_type : type of the data SRecords, 'S1', 'S2' or 'S3'
+                * data_len : number of data bytes per SRecord
+                * headers : header SRecords, written as they are
+                * entry : address of the footer SRecord (execution start address)
+                * align : see iter_lines_cuts
+    '''
+    if s_type not in DATA_TYPES:
+        raise ConvertError(f"{s_type} is not a data SRecord type")
+    addr_len = sr.SRecord.ADDR_LEN[s_type]
+    if not 0 < data_len <= 0xFF - addr_len - 1:
+        raise ConvertError(f"An {s_type} SRecord holds 1 to {0xFF - addr_len - 1} data bytes")
+    with srf.SRecordWriter(name) as writer:
+        writer.write_all(headers)
+        for address, data in pieces:
+            if address + len(data) > 1 << 8*addr_len:
+                raise ConvertError(f"Address 0x{address + len(data) - 1:X} is too high for an {s_type} SRecord")
+            view = memoryview(data)
+            for offset, size in iter_lines_cuts(address, len(data), data_len, align):
+                writer.write_line(sr.format_srec(s_type, address + offset, view[offset:offset + size], '\n'))
+        writer.write_line(sr.format_srec(FOOTER_OF[s_type], entry, b'', '\n'))
+
+def headers_and_entry(source):
+    '''
+    return the header SRecords of source and its entry address (None if unknown), the
+    entry address is the one of the first S7, S8 or S9 SRecord (an S5 count is ignored)
+    '''
+    if hasattr(source, 'header'):
+        headers, others = list(source.header.values()), list(source.footer.values())
+    elif hasattr(source, 'iter_others'):
+        others = list(source.iter_others())
+        headers = [srec for srec in others if srec.s_type in srf.HEADER_TYPES]
+    else:
+        return [], getattr(source, 'entry', None)
+    footers = [srec for srec in others if srec.s_type in srf.FOOTER_TYPES]
+    return headers, footers[0].address_u if footers else None
+
+def reblock(source, name, data_len = 32, s_type = None, align = False):
+    '''
+    Write the data of source (SRecordFile, SRecordImage or a streaming source) into an
+    SRecord file with data_len bytes per SRecord, of type s_type (by default, the
+    smallest type able to hold the addresses of source). Headers and the entry address
+    are kept.
+    '''
+    headers, entry = headers_and_entry(source)
+    if s_type is None:
+        s_type = smallest_type(max(end for start, end in source_sectors(source)))
+    write_srec(source.iter_sector_data(), name, s_type, data_len, headers, entry or 0, align)
+
+#################
+# Binary images
+#################
+
+class BinarySource:
+    '''
+    Raw binary image read as pieces of data, the first byte being at address
+    '''
+    def __init__(self, path, address = 0):
+        self.path = path
+        self.address = address
+
+    def iter_sectors(self):
+        size = os.path.getsize(self.path)
+        return iter([srf.Sector(start=self.address, end=self.address + size - 1)] if size else [])
+
+    def iter_sector_data(self):
+        address = self.address
+        with open(self.path, 'rb') as bin_f:
+            for chunk in iter(partial(bin_f.read, PIECE_SIZE), b''):
+                yield address, chunk
+                address += len(chunk)
+
+def source_sectors(source):
+    '''
+    return the ranges of data of source, (start, end) sorted and merged
+    (the empty range of an S5 count SRecord kept by an SRecordFile is dropped)
+    '''
+    sectors = source.sectors if hasattr(source, 'sectors') else source.iter_sectors()
+    return list(srf.merge_ranges(sorted(sector for sector in sectors if sector[1] >= sector[0])))
+
+def write_binary(source, name, fill = 0xFF, start = None):
+    '''
+    Write the data of source into a raw binary image, from start (by default, the
+    lower address of source) to its higher address. The gaps are filled with fill.
+    Output : the address of the first byte of the image
+    '''
+    sectors = source_sectors(source)
+    if not sectors:
+        raise ConvertError("No data to convert")
+    if start is None:
+        start = sectors[0].start
+    elif start > sectors[0].start:
+        raise ConvertError(f"Data found at 0x{sectors[0].start:X}, below the start of the image")
+    with open(name, 'wb') as bin_f:
+        #gaps first, then the data at its offset : the pieces can come in any order
+        crt_addr = start
+        for sector in sectors:
+            gap = sector.start - crt_addr
+            while gap > 0:
+                bin_f.write(bytes([fill])*min(gap, PIECE_SIZE))
+                gap -= PIECE_SIZE
+            bin_f.seek(sector.end + 1 - start)
+            crt_addr = sector.end + 1
+        for address, data in source.iter_sector_data():
+            if not data:
+                continue
+            bin_f.seek(address - start)
+            bin_f.write(data)
+    return start
+
+#################
+# Intel HEX files
+#################
+
+IHEX_DATA, IHEX_EOF, IHEX_EXT_SEGMENT, IHEX_START_SEGMENT, IHEX_EXT_LINEAR, IHEX_START_LINEAR = range(6)
+
+def format_ihex(rec_type, address, data, end = ''):
+    '''
+    return the text of the Intel HEX record made of the given fields, checksum included
+    '''
+    body = bytes([len(data), (address >> 8) & 0xFF, address & 0xFF, rec_type]) + data
+    return ':' + body.hex().upper() + "{0:0>2X}".format(-sum(body) & 0xFF) + end
+
+class IntelHexSource:
+    '''
+    Intel HEX file read as pieces of data, in file order
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def entry(self):
+        '''
+        address of the last start address record of the file, None if there is none
+        '''
+        entry = None
+        with open(self.path, 'r') as hex_f:
+            for line in hex_f:
+                line = line.strip()
+                if line[7:9] in ('03', '05'):
+                    data = bytes.fromhex(line[9:-2])
+                    entry = int.from_bytes(data, 'big') if line[7:9] == '05' else (int.from_bytes(data[:2], 'big') << 4) + int.from_bytes(data[2:], 'big')
+        return entry
+
+    def iter_records(self):
+        '''
+        Generator of (address, data) of the data records, with their full address
+        '''
+        base = 0
+        with open(self.path, 'r') as hex_f:
+            for line_nb, line in enumerate(hex_f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    if line[0] != ':':
+                        raise ValueError
+                    body = bytes.fromhex(line[1:])
+                except ValueError:
+                    raise ConvertError(f"line {line_nb} : not an Intel HEX record")
+                if len(body) < 5 or body[0] != len(body) - 5:
+                    raise ConvertError(f"line {line_nb} : byte count field value is incorrect")
+                if sum(body) & 0xFF:
+                    raise ConvertError(f"line {line_nb} : wrong checksum")
+                rec_type, data = body[3], body[4:-1]
+                if rec_type == IHEX_DATA:
+                    yield base + int.from_bytes(body[1:3], 'big'), data
+                elif rec_type == IHEX_EOF:
+                    return
+                elif rec_type == IHEX_EXT_SEGMENT:
+                    base = int.from_bytes(data, 'big') << 4
+                elif rec_type == IHEX_EXT_LINEAR:
+                    base = int.from_bytes(data, 'big') << 16
+
+    def iter_sectors(self):
+        return srf.merge_ranges((address, address + len(data) - 1) for address, data in self.iter_records() if data)
+
+    def iter_sector_data(self):
+        '''
+        Generator of (address, data) of the ranges of contiguous data, in file order,
+        cut in pieces of about PIECE_SIZE bytes
+        '''
+        return srf.join_pieces(self.iter_records(), PIECE_SIZE)
+
+def write_ihex(pieces, name, data_len = 16, entry = None):
+    '''
+    Write pieces of data into an Intel HEX file (extended linear addresses)
+        Input   * pieces : iterable of (address, data)
+                * data_len : number of data bytes per record
+                * entry : if given, written as a start linear address record
+    '''
+    if not 0 < data_len <= 0xFF:
+        raise ConvertError("An Intel HEX record holds 1 to 255 data bytes")
+    upper = 0
+    with srf.SRecordWriter(name) as writer:
+        for address, data in pieces:
+            if address + len(data) > 1 << 32:
+                raise ConvertError(f"Address 0x{address + len(data) - 1:X} is too high for an Intel HEX file")
+            view = memoryview(data)
+            #a record never goes over a 64 KiB boundary
+            for offset, size in iter_lines_cuts(address, len(data), data_len, boundary=1 << 16):
+                crt_addr = address + offset
+                if crt_addr >> 16 != upper:
+                    upper = crt_addr >> 16
+                    writer.write_line(format_ihex(IHEX_EXT_LINEAR, 0, upper.to_bytes(2, 'big'), '\n'))
+                writer.write_line(format_ihex(IHEX_DATA, crt_addr, view[offset:offset + size], '\n'))
+        if entry is not None:
+            writer.write_line(format_ihex(IHEX_START_LINEAR, 0, entry.to_bytes(4, 'big'), '\n'))
+        writer.write_line(format_ihex(IHEX_EOF, 0, b'', '\n'))
+
+##############################################
+# Conversion of files, format found by extension
+##############################################
+
+FORMATS = {
+    '.bin' : 'bin',
+    '.hex' : 'ihex', '.ihex' : 'ihex',
+    '.s19' : 'srec', '.s28' : 'srec', '.s37' : 'srec', '.srec' : 'srec', '.mot' : 'srec',
+    }
+
+def format_of(path):
+    try:
+        return FORMATS[os.path.splitext(path)[1].lower()]
+    except KeyError:
+        raise ConvertError(f"Unknown format for {path}, it must be given")
+
+def open_source(path, in_format = None, address = 0):
+    '''
+    return a streaming source (iter_sector_data) of the file at path
+    address is the address of the first byte of a binary file
+    '''
+    in_format = in_format or format_of(path)
+    if in_format == 'bin':
+        return BinarySource(path, address)
+    if in_format == 'ihex':
+        return IntelHexSource(path)
+    return srf.SRecordFile.open_streaming(path)
+
+def convert(source, name, out_format = None, fill = 0xFF, data_len = None, s_type = None, align = False):
+    '''
+    Write the data of source (SRecordFile, SRecordImage or a streaming source) into
+    the file name, in out_format ('srec', 'ihex' or 'bin', by default found from the
+    extension of name)
+    '''
+    out_format = out_format or format_of(name)
+    if out_format == 'bin':
+        write_binary(source, name, fill)
+    elif out_format == 'ihex':
+        write_ihex(source.iter_sector_data(), name, data_len or 16, headers_and_entry(source)[1])
+    else:
+        reblock(source, name, data_len or 32, s_type, align)
+
+def main():
+    convert_pars = argparse.ArgumentParser(description="Convert SRecord, Intel HEX and binary files, the data is streamed")
+    convert_pars.add_argument('input', help='File to convert')
+    convert_pars.add_argument('output', help='File to write')
+    convert_pars.add_argument('-if', '--in_format', help='Format of the input file (default : found from its extension)', choices=['srec', 'ihex', 'bin'])
+    convert_pars.add_argument('-of', '--out_format', help='Format of the output file (default : found from its extension)', choices=['srec', 'ihex', 'bin'])
+    convert_pars.add_argument('-a', '--address', help='Hex address of the first byte of a binary input file', default='0')
+    convert_pars.add_argument('-fb', '--fill_byte', help='Hex byte written in the gaps of a binary output file', default='FF')
+    convert_pars.add_argument('-dl', '--data_len', help='Number of data bytes per record', type=int)
+    convert_pars.add_argument('-st', '--s_type', help='Type of the data SRecords written (default : the smallest one)', choices=list(DATA_TYPES))
+    convert_pars.add_argument('--align', help='Records start at multiples of data_len', action='store_true')
+    args = convert_pars.parse_args()
+    source = open_source(args.input, args.in_format, sr.INT(args.address))
+    convert(source, args.output, args.out_format, sr.INT(args.fill_byte), args.data_len, args.s_type, args.align)
+
+if __name__ == '__main__':
+    main()
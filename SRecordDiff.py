@@ -0,0 +1,112 @@
+import SRecordFile as srf
+import collections
+import re
+
+from bisect import bisect_right
+
+#Result of a comparison between two images, every range is a Sector (start, end)
+#   * changed : ranges present in both images, with different data
+#   * added : ranges only present in the new image
+#   * removed : ranges only present in the old image
+ImageDiff = collections.namedtuple('ImageDiff', ['changed', 'added', 'removed', 'changed_bytes', 'added_bytes', 'removed_bytes'])
+
+#size of the blocks compared at once, and size under which a different block is xored
+DIFF_CHUNK = 1 << 20
+DIFF_MIN_BLOCK = 1 << 12
+#translation of the bytes of the xor of two blocks : 0 where they are equal, 1 elsewhere
+DIFF_MASK = bytes([0]) + bytes([1])*255
+DIFF_RUN = re.compile(b'\x01+')
+
+def range_len(ranges):
+    return sum(end - start + 1 for start, end in ranges)
+
+def intersect_ranges(a_ranges, b_ranges):
+    '''
+    Input : two lists of (start, end) sorted, not overlapping
+    Output : the list of the Sectors covered by both lists
+    '''
+    common = []
+    i = j = 0
+    while i < len(a_ranges) and j < len(b_ranges):
+        start = max(a_ranges[i][0], b_ranges[j][0])
+        end = min(a_ranges[i][1], b_ranges[j][1])
+        if start <= end:
+            common.append(srf.Sector(start=start, end=end))
+        if a_ranges[i][1] < b_ranges[j][1]:
+            i += 1
+        else:
+            j += 1
+    return common
+
+def subtract_ranges(a_ranges, b_ranges):
+    '''
+    Input : two lists of (start, end) sorted, not overlapping
+    Output : the list of the Sectors covered by a_ranges and not by b_ranges
+    '''
+    remaining = []
+    j = 0
+    for start, end in a_ranges:
+        while j < len(b_ranges) and b_ranges[j][1] < start:
+            j += 1
+        k = j
+        while k < len(b_ranges) and b_ranges[k][0] <= end:
+            if b_ranges[k][0] > start:
+                remaining.append(srf.Sector(start=start, end=b_ranges[k][0] - 1))
+            start = max(start, b_ranges[k][1] + 1)
+            k += 1
+        if start <= end:
+            remaining.append(srf.Sector(start=start, end=end))
+    return remaining
+
+def diff_buffers(old, new, address, changed):
+    '''
+    Compare two buffers of the same length holding the data found at address, and
+    append the ranges of different bytes to changed (list of Sectors, adjacent
+    ranges are merged). Blocks are compared as a whole, a different block is cut in
+    two halves until it is small enough : its bytes are then xored as big integers
+    and the runs of non zero bytes are found by a regular expression, no byte is
+    compared one by one in Python.
+    '''
+    blocks = [(offset, min(offset + DIFF_CHUNK, len(old))) for offset in range(0, len(old), DIFF_CHUNK)]
+    blocks.reverse()
+    while blocks:
+        lo, hi = blocks.pop()
+        old_block, new_block = old[lo:hi], new[lo:hi]
+        if old_block == new_block:
+            continue
+        if hi - lo > DIFF_MIN_BLOCK:
+            mid = (lo + hi) // 2
+            blocks.append((mid, hi))
+            blocks.append((lo, mid))
+            continue
+        xored = (int.from_bytes(old_block, 'big') ^ int.from_bytes(new_block, 'big')).to_bytes(hi - lo, 'big')
+        for run in DIFF_RUN.finditer(xored.translate(DIFF_MASK)):
+            start, end = address + lo + run.start(), address + lo + run.end() - 1
+            if changed and changed[-1].end == start - 1:
+                changed[-1] = srf.Sector(start=changed[-1].start, end=end)
+            else:
+                changed.append(srf.Sector(start=start, end=end))
+
+def diff_images(old, new):
+    '''
+    Compare two images address by address
+        Input   * old, new : SRecordFile or SRecordImage objects
+        Output  * an ImageDiff
+    '''
+    old_runs = sorted(old.iter_sector_data())
+    new_runs = sorted(new.iter_sector_data())
+    old_ranges = [(start, start + len(data) - 1) for start, data in old_runs]
+    new_ranges = [(start, start + len(data) - 1) for start, data in new_runs]
+    old_starts = [start for start, data in old_runs]
+    new_starts = [start for start, data in new_runs]
+
+    changed = []
+    for start, end in intersect_ranges(old_ranges, new_ranges):
+        old_start, old_data = old_runs[bisect_right(old_starts, start) - 1]
+        new_start, new_data = new_runs[bisect_right(new_starts, start) - 1]
+        diff_buffers(old_data[start - old_start:end - old_start + 1], new_data[start - new_start:end - new_start + 1], start, changed)
+
+    added = subtract_ranges(new_ranges, old_ranges)
+    removed = subtract_ranges(old_ranges, new_ranges)
+    return ImageDiff(changed=changed, added=added, removed=removed,
+                     changed_bytes=range_len(changed), added_bytes=range_len(added), removed_bytes=range_len(removed))
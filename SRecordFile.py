@@ -1,8 +1,21 @@
 import SRecord as sr
+import SRecordCache as src
+import SRecordStats as srs
 import collections
+import hashlib
+import logging
+import mmap
 import os
+import shutil
+import sys
+import tempfile
 
-from bisect import bisect_right
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
+from functools import partial
+from itertools import accumulate, chain, compress, islice, repeat
+from operator import add, ge, itemgetter, sub
 
 Coord = collections.namedtuple('Coord', ['line', 'idx'])
 
@@ -14,53 +27,738 @@ class SRecordFileError(Exception):
 class AccessSrecFileError(SRecordFileError):
     pass
 
-class SRecordFile:
+class ChecksumSrecFileError(SRecordFileError):
+    def __init__(self, lines):
+        super().__init__(f"{len(lines)} data SRecord(s) with a wrong checksum")
+        self.lines = lines
+
+#number of SRecords whose checksums are computed at once
+CHECKSUM_BATCH = 1 << 16
+
+#estimated memory used by a data SRecord kept in memory, its data excluded (see SRec_bench)
+RECORD_FOOTPRINT = 320
+
+HEADER_TYPES = ('S0',)
+FOOTER_TYPES = ('S7', 'S8', 'S9')
+
+#the loading messages are logged at INFO level : silent unless logging is configured
+logger = logging.getLogger(__name__)
+
+def iter_records(path):
+    '''
+    Generator of the SRecords of the file at path, each one with its offset in the file.
+    The file is read line by line, so it is never loaded as a whole.
+    '''
+    offset = 0
+    with open(path, 'rb') as srec_f:
+        for line in srec_f:
+            if line.strip():
+                yield sr.SRecord(line.decode('ascii', 'replace'), offset)
+            offset += len(line)
+
+def file_stat(path):
+    '''
+    return (size, modification time) of the file at path, used to know if it was
+    modified by someone else since it was read
+    '''
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def file_digest(path, chunk_size = 1 << 20):
+    '''
+    return the blake2b digest of the content of the file at path, as an hex string
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as srec_f:
+        for chunk in iter(partial(srec_f.read, chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def merge_ranges(ranges):
+    '''
+    Generator of the Sectors made of an iterable of (start, end) ranges, taken in
+    the given order : a range starting right after the previous one extends it
+    '''
+    start = None
+    for crt_start, crt_end in ranges:
+        if start is None:
+            start = crt_start
+        elif crt_start != end + 1:
+            yield Sector(start=start, end=end)
+            start = crt_start
+        end = crt_end
+    if start is not None:
+        yield Sector(start=start, end=end)
+
+def join_pieces(pieces, chunk_size = None):
+    '''
+    Generator of (start address, data) joining an iterable of (address, data) pieces,
+    taken in the given order : a piece starting right after the previous one extends
+    it. If chunk_size is given, the data is cut in chunks of about chunk_size bytes.
+    '''
+    start = None
+    chunks = []
+    chunks_len = 0
+    for address, data in pieces:
+        if chunks and (address != start + chunks_len or (chunk_size is not None and chunks_len >= chunk_size)):
+            yield start, b''.join(chunks)
+            chunks = []
+        if not chunks:
+            start = address
+            chunks_len = 0
+        chunks.append(data)
+        chunks_len += len(data)
+    if chunks:
+        yield start, b''.join(chunks)
+
+def iter_sectors(srecords):
+    '''
+    Generator of the Sectors (ranges of contiguous data) found in an iterable of
+    data SRecords, taken in the given order
+    '''
+    return merge_ranges((srec.address_u, srec.end_address()) for srec in srecords)
+
+ADDR_ARRAY_TYPE = {2:'H', 3:'I', 4:'I'}
+
+def index_lines(buffer, chunk_size = 1 << 24):
+    '''
+    Index the lines of an SRecord file (bytes or mmap) without parsing them.
+    The buffer is cut into chunks of whole lines. In each chunk, the lines of the
+    most common data type are indexed with bulk operations (split, map, bytes.fromhex
+    and array conversions) instead of a loop over the lines, the other ones are
+    indexed one by one.
+    Output : a tuple with
+                * addrs, offsets, lens : array('Q') of the address and offset of each
+                  data line, array('B') of its data length, in file order
+                * addr_lens : set of the address lengths (in bytes) of the data lines
+                * others : offsets of the header and footer lines
+    '''
+    addrs   = array('Q')
+    offsets = array('Q')
+    lens    = array('B')
+    addr_lens = set()
+    others = []
+    pos = 0
+    while pos < len(buffer):
+        end = buffer.find(b'\n', pos + chunk_size)
+        end = len(buffer) if end == -1 else end + 1
+        lines = buffer[pos:end].split(b'\n')
+        line_offsets = array('Q', accumulate(chain([pos], map(add, map(len, lines), repeat(1)))))
+        pos = end
+
+        s_type = lines[len(lines)//2][:2].decode('ascii', 'replace')
+        if s_type in HEADER_TYPES + FOOTER_TYPES or s_type not in sr.SRecord.ADDR_LEN:
+            s_type = None
+        types = list(map(itemgetter(slice(0, 2)), lines))
+        main_type = s_type.encode('ascii') if s_type else None
+        odd_lines = [i for i, crt_type in enumerate(types) if crt_type != main_type]
+        #lines of another type (blank lines, headers, footers, indented lines...)
+        odd_data = []
+        for i in reversed(odd_lines):
+            crt_index = index_line(lines[i], line_offsets[i])
+            if crt_index is None:
+                pass
+            elif crt_index[0] in HEADER_TYPES + FOOTER_TYPES:
+                others.append(crt_index[1])
+            else:
+                odd_data.append(crt_index)
+            del lines[i]
+            del line_offsets[i]
+        del line_offsets[len(lines):]
+
+        if lines:
+            addr_len = sr.SRecord.ADDR_LEN[s_type]
+            addr_lens.add(addr_len)
+            try:
+                addr_field = map(itemgetter(slice(4, 4 + 2*addr_len)), lines)
+                if addr_len == 3:
+                    addr_field = map(b'00'.__add__, addr_field)
+                chunk_addrs = array(ADDR_ARRAY_TYPE[addr_len], bytes.fromhex(b''.join(addr_field).decode('ascii')))
+                counts = bytes.fromhex(b''.join(map(itemgetter(slice(2, 4)), lines)).decode('ascii'))
+                chunk_lens = bytes(map(sub, counts, repeat(addr_len + 1)))
+            except ValueError:
+                raise sr.CorruptedSRecError(f"Incorrect address or count field in a {s_type} SRecord")
+            if sys.byteorder == 'little':
+                chunk_addrs.byteswap()
+        else:
+            chunk_addrs, chunk_lens = [], b''
+
+        if not odd_data:
+            addrs.extend(array('Q', chunk_addrs))
+            offsets.extend(line_offsets)
+            lens.frombytes(chunk_lens)
+        else:
+            #keep the file order
+            for crt_type, offset, address, length in sorted(chain(odd_data, zip(repeat(s_type), line_offsets, chunk_addrs, chunk_lens)), key=itemgetter(1)):
+                addr_lens.add(sr.SRecord.ADDR_LEN[crt_type])
+                addrs.append(address)
+                offsets.append(offset)
+                lens.append(length)
+    return addrs, offsets, lens, addr_lens, sorted(others)
+
+def index_line(line, offset):
+    '''
+    Index a single line found at offset in the file
+    Output : None for a blank line, else a tuple (type, offset of the SRecord, address, data length)
+             address and data length are None for header and footer lines
+    '''
+    srec = line.lstrip()
+    offset += len(line) - len(srec)
+    srec = srec.rstrip()
+    if not srec:
+        return None
+    s_type = srec[:2].decode('ascii', 'replace')
+    if s_type not in sr.SRecord.ADDR_LEN:
+        raise sr.CorruptedSRecError("Unknown type of SRecord")
+    if s_type in HEADER_TYPES + FOOTER_TYPES:
+        return (s_type, offset, None, None)
+    addr_len = sr.SRecord.ADDR_LEN[s_type]
+    try:
+        length = int(srec[2:4], 16) - addr_len - 1
+        address = int(srec[4:4 + 2*addr_len], 16)
+    except ValueError:
+        raise sr.CorruptedSRecError(f"Incorrect address or count field in a {s_type} SRecord")
+    if length < 0:
+        raise sr.CorruptedSRecError("Count field value is incorrect")
+    return (s_type, offset, address, length)
+
+def parse_line(buffer, offset):
+    '''
+    return the SRecord of the line starting at offset in buffer (bytes or mmap)
+    '''
+    end = buffer.find(b'\n', offset)
+    if end == -1:
+        end = len(buffer)
+    return sr.SRecord(buffer[offset:end].decode('ascii'), offset)
+
+class LazyRecords(Mapping):
+    '''
+    Data SRecords of a file mapped in memory, keyed by line address.
+    Only an index of the lines is kept (addresses and offsets in array('Q')) :
+    a line is parsed the first time its address is accessed, then kept.
+    '''
+
+    def __init__(self, buffer, addrs, offsets, lens):
+        self.buffer = buffer
+        self.addrs = addrs
+        self.offsets = offsets
+        self.lens = lens
+        self.cache = {}
+
+    def index(self, address):
+        if srs.stats.enabled:
+            srs.stats.count(srs.BISECT_CALLS)
+        idx = bisect_left(self.addrs, address)
+        if idx == len(self.addrs) or self.addrs[idx] != address:
+            raise KeyError(address)
+        return idx
+
+    def __getitem__(self, address):
+        try:
+            return self.cache[address]
+        except KeyError:
+            crt_srec = parse_line(self.buffer, self.offsets[self.index(address)])
+            srs.stats.count(srs.RECORDS_PARSED)
+            self.cache[address] = crt_srec
+            return crt_srec
+
+    def __contains__(self, address):
+        try:
+            self.index(address)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.addrs)
+
+    def __iter__(self):
+        return iter(self.addrs)
+
+    def values(self):
+        '''
+        Generator of every data SRecord. Lines which were never accessed are parsed
+        but not kept, so going through the whole file does not fill the cache
+        '''
+        for address, offset in zip(self.addrs, self.offsets):
+            crt_srec = self.cache.get(address)
+            yield crt_srec if crt_srec is not None else parse_line(self.buffer, offset)
+
+def validate_lines(lines, first_line_nb = 1):
+    '''
+    Parse lines of SRecord (str) and check their checksums
+    Output : a list of (line number, error message), empty if every line is correct
+    '''
+    errors = []
+    for line_nb, line in enumerate(lines, first_line_nb):
+        if not line.strip():
+            continue
+        try:
+            crt_srec = sr.SRecord(line)
+        except sr.SRecordError as e:
+            errors.append((line_nb, str(e)))
+        else:
+            if crt_srec.checksum_u != crt_srec.compute_checksum_u():
+                errors.append((line_nb, "Wrong checksum"))
+    return errors
+
+#########################################################
+# Parallel parsing : the file is cut in chunks of lines,
+# each one handled by a process of a ProcessPoolExecutor
+#########################################################
+
+PARALLEL_MIN_CHUNK = 1 << 20
+
+def split_chunks(path, nb_chunks):
+    '''
+    Cut the file at path in about nb_chunks ranges of whole lines
+    Output : a list of (start, end) byte offsets
+    '''
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as srec_f:
+        for i in range(1, nb_chunks):
+            if i*size//nb_chunks <= bounds[-1]:
+                continue
+            srec_f.seek(i*size//nb_chunks)
+            srec_f.readline()
+            if srec_f.tell() >= size:
+                break
+            bounds.append(srec_f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def read_chunk_lines(path, start, end):
+    with open(path, 'rb') as srec_f:
+        srec_f.seek(start)
+        lines = srec_f.read(end - start).decode('ascii', 'replace').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+#Lines parsed by parse_chunk, in file order, packed to be sent between processes :
+#   * others : list of the SRecords which are not S1, S2 or S3
+#   * addrs, offsets : array('Q') of the address and offset in the file of each S1, S2
+#     or S3 line, lens, types, cks : its data length, type ('1', '2' or '3') and checksum,
+#     one byte per line, data : the data of the lines, one after the other
+#   * sectors : list of the Sectors found, in file order
+ChunkLines = collections.namedtuple('ChunkLines', ['others', 'addrs', 'offsets', 'lens', 'types', 'cks', 'data', 'sectors'])
+
+def parse_chunk(path, start, end):
+    '''
+    Parse the lines between the byte offsets start and end of the file at path
+    Output : the ChunkLines of the chunk
+    '''
+    srecords = []
+    offset = start
+    for line in read_chunk_lines(path, start, end):
+        if line.strip():
+            srecords.append(sr.SRecord(line, offset))
+        offset += len(line) + 1
+    sectors = list(iter_sectors(srec for srec in srecords if srec.s_type not in HEADER_TYPES + FOOTER_TYPES))
+    data = [srec for srec in srecords if srec.s_type in ('S1', 'S2', 'S3')]
+    return ChunkLines(others=[srec for srec in srecords if srec.s_type not in ('S1', 'S2', 'S3')],
+                      addrs=array('Q', (srec.address_u for srec in data)), offsets=array('Q', (srec.offset for srec in data)),
+                      lens=bytes(len(srec.data) for srec in data), types=bytes(ord(srec.s_type[1]) for srec in data),
+                      cks=bytes(srec.checksum_u for srec in data), data=b''.join(srec.data for srec in data), sectors=sectors)
+
+def join_chunks(chunks):
+    '''
+    return the ChunkLines of consecutive chunks put together, their sectors are merged
+    as a sector can go on from a chunk to the next one
+    '''
+    addrs, offsets = array('Q'), array('Q')
+    for chunk in chunks:
+        addrs += chunk.addrs
+        offsets += chunk.offsets
+    return ChunkLines(others=list(chain.from_iterable(chunk.others for chunk in chunks)), addrs=addrs, offsets=offsets,
+                      lens=b''.join(chunk.lens for chunk in chunks), types=b''.join(chunk.types for chunk in chunks),
+                      cks=b''.join(chunk.cks for chunk in chunks), data=b''.join(chunk.data for chunk in chunks),
+                      sectors=list(merge_ranges(chain.from_iterable(chunk.sectors for chunk in chunks))))
+
+def iter_chunk_srecords(lines):
+    '''
+    return an iterator of the S1, S2 and S3 SRecords of a ChunkLines, in file order
+    '''
+    ends = list(accumulate(lines.lens))
+    datas = map(lines.data.__getitem__, map(slice, chain([0], ends), ends))
+    types = map('S{:c}'.format, lines.types)
+    return map(sr.SRecord.from_fields, types, lines.addrs, datas, lines.cks, lines.offsets)
+
+def validate_chunk(path, start, end):
+    '''
+    Validate the lines between the byte offsets start and end of the file at path
+    Output : the number of lines of the chunk and its errors (numbered from 1)
+    '''
+    lines = read_chunk_lines(path, start, end)
+    return len(lines), validate_lines(lines)
+
+def nb_chunks_for(path, workers):
+    return max(1, min(4*workers, os.path.getsize(path)//PARALLEL_MIN_CHUNK))
+
+def process_pool(workers):
+    '''
+    return a ProcessPoolExecutor of workers processes
+    (multiprocessing is slow to import, it is only imported when a pool is needed)
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=workers)
+
+def validate_files(paths, workers = None):
+    '''
+    Validate several SRecord files, each one being cut in chunks validated in parallel
+    (all the chunks of all the files share the same pool of processes)
+    Output : a dictionnary path -> list of (line number, error message)
+    '''
+    workers = workers or os.cpu_count()
+    with process_pool(workers) as executor:
+        futures = {path:[executor.submit(validate_chunk, path, start, end) for start, end in split_chunks(path, nb_chunks_for(path, workers))]
+                   for path in paths}
+        results = {}
+        for path, path_futures in futures.items():
+            results[path] = []
+            first_line_nb = 0
+            for future in path_futures:
+                nb_lines, errors = future.result()
+                results[path] += [(line_nb + first_line_nb, error) for line_nb, error in errors]
+                first_line_nb += nb_lines
+    return results
+
+def validate_file(path, workers = None):
+    '''
+    Validate an SRecord file in parallel, see validate_files
+    '''
+    return validate_files([path], workers)[path]
+
+def hex_patch(position, value):
+    '''
+    Input : position, an address, and value, data to write there, hexadecimal strings
+    Output : (address, data) as integer and bytes
+    '''
+    if len(value)%2 != 0:
+        raise SRecordFileError("Patching requieres full byte data, i.e. an even number of char")
+    try:
+        return sr.INT(position), bytes.fromhex(value)
+    except ValueError:
+        raise SRecordFileError("Patching address and value must be hex strings")
+
+def overlay_writes(source, offset = 0, start = None):
+    '''
+    return the writes, a list of (address, data), copying the data of source (an
+    object with iter_sector_data) at its own addresses plus offset, or relocated so
+    that its lower address is start if start is given
+    '''
+    pieces = list(source.iter_sector_data())
+    if pieces and start is not None:
+        offset = start - min(piece_start for piece_start, data in pieces)
+    return [(piece_start + offset, data) for piece_start, data in pieces]
+
+class SRecordWriter:
+    '''
+    Buffered SRecord writer : lines are gathered and written to the file by chunks
+    of about chunk_size characters instead of one write() call per SRecord
+    '''
+
+    def __init__(self, name, chunk_size = 1 << 20):
+        self.srec_f = open(name, 'w+')
+        self.chunk_size = chunk_size
+        self.chunk = []
+        self.chunk_len = 0
+
+    def write_line(self, line):
+        '''
+        add a line of text (end of line included) to the current chunk
+        '''
+        self.chunk.append(line)
+        self.chunk_len += len(line)
+        if self.chunk_len >= self.chunk_size:
+            self.flush()
+
+    def write(self, srec):
+        self.write_line(srec.to_string(end='\n'))
+
+    def write_all(self, srecords):
+        for srec in srecords:
+            self.write_line(srec.to_string(end='\n'))
+
+    def flush(self):
+        srs.stats.count(srs.BYTES_WRITTEN, self.chunk_len)
+        self.srec_f.write(''.join(self.chunk))
+        self.chunk = []
+        self.chunk_len = 0
+
+    def close(self):
+        self.flush()
+        self.srec_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class SRecordStream:
+    '''
+    Streaming view of an SRecord file : every operation reads the file again, one
+    line at a time, so memory use does not depend on the size of the file
+    '''
 
     def __init__(self, file_name):
+        self.path = file_name
+        self.name = os.path.basename(file_name)
+
+    def __iter__(self):
+        return iter_records(self.path)
+
+    def iter_data(self):
+        return (srec for srec in self if srec.s_type not in HEADER_TYPES + FOOTER_TYPES)
+
+    def iter_others(self):
+        '''
+        Generator of the header and footer SRecords, the data lines are not parsed
+        '''
+        with open(self.path, 'r') as srec_f:
+            for line in srec_f:
+                if line.lstrip()[:2] in HEADER_TYPES + FOOTER_TYPES:
+                    yield sr.SRecord(line)
+
+    def validate(self):
+        '''
+        Parse the whole file and check every checksum
+        Output : a list of (line number, error message), empty if the file is correct
+        '''
+        with open(self.path, 'r') as srec_f:
+            return validate_lines(srec_f)
+
+    def iter_sectors(self):
+        '''
+        Generator of the Sectors of the file, in file order
+        '''
+        return iter_sectors(self.iter_data())
+
+    def iter_sector_data(self, chunk_size = 1 << 20):
+        '''
+        Generator of (start address, data) for the ranges of contiguous data of the
+        file, in file order. A range is cut in pieces of about chunk_size bytes.
+        '''
+        return join_pieces(((srec.address_u, srec.data) for srec in self.iter_data()), chunk_size)
+
+    def extract_range(self, start, end):
+        '''
+        Generator of the data SRecords holding bytes between start and end (included),
+        SRecords overlapping a bound are cut to the range
+        '''
+        for crt_srec in self.iter_data():
+            if crt_srec.address_u > end or crt_srec.end_address() < start:
+                continue
+            if crt_srec.address_u < start or crt_srec.end_address() > end:
+                first = max(start, crt_srec.address_u) - crt_srec.address_u
+                last = min(end, crt_srec.end_address()) - crt_srec.address_u
+                crt_srec = sr.SRecord.from_fields(crt_srec.s_type, crt_srec.address_u + first, crt_srec.data[first:last + 1])
+            yield crt_srec
+
+    def export_range(self, start, end, name):
+        '''
+        Write the headers, the data between start and end (included) and the footers
+        of the file into a new SRecord file
+        '''
+        with SRecordWriter(name) as writer:
+            writer.write_all(srec for srec in self if srec.s_type in HEADER_TYPES)
+            writer.write_all(self.extract_range(start, end))
+            writer.write_all(srec for srec in self if srec.s_type in FOOTER_TYPES)
+
+class SRecordFile:
+
+    #layout of the cache files of the class : sectors in file order, S5 SRecords kept as data
+    CACHE_KIND = 'file'
+
+    def __init__(self, file_name, lazy = False, workers = 1, verify = False, cache = False):
         '''
         This function takes a motorola SRecord file and outputs a SRecordFile instance as follow :
             a list of header SRecord
             a list of footer SRecord
             a dictionnary of data SRecord, each SRecord having its own address for key
+        If lazy is set, the file is mapped in memory and only indexed : data SRecords
+        are parsed when they are accessed (see LazyRecords)
+        If workers is greater than 1, the file is parsed by that many processes
+        If verify is set, the checksums of the data SRecords are checked once the file
+        is loaded, a ChecksumSrecFileError is raised if some of them are wrong
+        If cache is set, the parsed file is written in the cache of parsed images (see
+        SRecordCache), and taken from it the next time, as long as the file does not change
+        The SRecords modified are kept in self.dirty until the file is saved (see save)
         '''
-        self.sectors = []
-        self.start = ''
         self.path = file_name
         self.name = os.path.basename(file_name)
-        print("Importing file ", self.name)
+        self.lazy = lazy
+        self.workers = workers
+        self.dirty = set()
+        self.file_stat = file_stat(file_name)
+        #set once save has written something to the file
+        self.modified = False
+        #digest of the content of the file, computed only to use the cache
+        self.digest = None
+        logger.info("Importing file  %s", self.name)
+        with srs.stats.timer('load'):
+            layout = None
+            if cache and not lazy:
+                self.digest = file_digest(file_name)
+                layout = src.read_cache(file_name, self.CACHE_KIND, self.digest)
+            if layout is not None:
+                self.load_layout(layout)
+                srs.stats.count(srs.CACHE_HITS)
+            elif lazy:
+                self.load_index(file_name)
+            elif workers > 1:
+                self.load_parallel(file_name, workers)
+            else:
+                self.load_srecords(iter_records(file_name))
+            if layout is None:
+                srs.stats.count(srs.BYTES_READ, self.file_stat[0])
+                if not lazy:
+                    srs.stats.count(srs.RECORDS_PARSED, len(self.addr_list) + len(self.header) + len(self.footer))
+            if cache and not lazy and layout is None:
+                src.write_cache(file_name, self.CACHE_KIND, self.digest, self.image_layout())
+            if verify:
+                bad_lines = self.verify_checksums()
+                if bad_lines:
+                    raise ChecksumSrecFileError(bad_lines)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("%s successfully imported.\n%s", self.name, self.get_file_infos())
+
+    @classmethod
+    def open_streaming(cls, file_name):
+        '''
+        Return an SRecordStream of the file : validation, sector discovery and range
+        extraction are done in constant memory, without loading the file
+        '''
+        return SRecordStream(file_name)
+
+    def load_parallel(self, file_name, workers):
+        '''
+        Parse the file by chunks of lines in a pool of processes, each one sends back
+        its lines packed in a ChunkLines, the chunks are then put together
+        '''
+        with process_pool(workers) as executor:
+            chunks = list(executor.map(parse_chunk, repeat(file_name), *zip(*split_chunks(file_name, nb_chunks_for(file_name, workers)))))
+        self.load_lines(join_chunks(chunks))
+
+    def load_lines(self, lines):
+        '''
+        Load the lines of a ChunkLines (see load_parallel)
+        '''
+        self.load_srecords(chain(lines.others, iter_chunk_srecords(lines)), lines.sectors)
+
+    def load_srecords(self, srecords, sectors = None):
+        '''
+        Sort an iterable of SRecord into header, data and footer, and find the sectors
+        (unless they are given, in file order)
+        '''
         self.header  = collections.OrderedDict()
         self.footer  = collections.OrderedDict()
         self.data    = {}
-        previous_Srec = sr.SRecord('S104000000FF')
-        with open(file_name, 'r') as srec_f:
-            srec_lines = srec_f.read().splitlines()
-        for line in srec_lines:
-            crt_srec = sr.SRecord(line)
-            if crt_srec.s_type == 'S0':
+        for crt_srec in srecords:
+            if crt_srec.s_type in HEADER_TYPES:
                 self.header[crt_srec.address_u] = crt_srec
-            elif crt_srec.s_type in ('S7', 'S8', 'S9'):
+            elif crt_srec.s_type in FOOTER_TYPES:
                 self.footer[crt_srec.address_u] = crt_srec
             else:
                 self.data[crt_srec.address_u] = crt_srec
-                if self.start == '':
-                    self.start = crt_srec.address_u
-                elif crt_srec.address_u != previous_Srec.end_address() + 1 :
-                    self.sectors.append(Sector(start=self.start, end= previous_Srec.end_address()))
-                    self.start = crt_srec.address_u
-                previous_Srec = crt_srec
-        self.sectors.append(Sector(start=self.start, end=previous_Srec.end_address()))
+        #sectors are found in file order, before sorting the data
+        self.sectors = list(iter_sectors(self.data.values()) if sectors is None else sectors)
+        self.start = self.sectors[-1].start
 
         self.data = collections.OrderedDict(sorted(self.data.items()))
         self.max_addr_len = max(SRec.addr_len('char') for SRec in self.data.values())
-        self.max_data_len = max([len(SRec.data_h) for SRec in self.data.values()])
+        self.max_data_len = max(len(SRec.data) for SRec in self.data.values())
         self.addr_list = list(self.data.keys())
         self.lower_addr = self.addr_list[0]
         self.higher_addr = self.data[self.addr_list[-1]].end_address()
         #format string usable to display addresses at the same lenght
         self.addrFormat = f"{{0:0>{self.max_addr_len}X}}"
-        print(f"{self.name} successfully imported.")
-        print(self.get_file_infos())
 
+    def load_index(self, file_name):
+        '''
+        Map the file in memory and index its data lines (address, offset and data
+        length, stored in arrays), headers and footers are parsed right away
+        '''
+        with open(file_name, 'rb') as srec_f:
+            buffer = mmap.mmap(srec_f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header  = collections.OrderedDict()
+        self.footer  = collections.OrderedDict()
+        addrs, offsets, lens, addr_lens, others = index_lines(buffer)
+        for offset in others:
+            crt_srec = parse_line(buffer, offset)
+            if crt_srec.s_type in HEADER_TYPES:
+                self.header[crt_srec.address_u] = crt_srec
+            else:
+                self.footer[crt_srec.address_u] = crt_srec
+        if not addrs:
+            raise SRecordFileError("No data SRecord found")
+
+        #sectors are found in file order, before sorting the index
+        self.sectors = list(merge_ranges((addr, addr + length - 1) for addr, length in zip(addrs, lens)))
+        self.start = self.sectors[-1].start
+        if any(map(ge, addrs, addrs[1:])):
+            order = sorted(range(len(addrs)), key=addrs.__getitem__)
+            addrs   = array('Q', (addrs[i] for i in order))
+            offsets = array('Q', (offsets[i] for i in order))
+            lens    = array('B', (lens[i] for i in order))
+
+        self.data = LazyRecords(buffer, addrs, offsets, lens)
+        self.max_addr_len = 2*max(addr_lens)
+        self.max_data_len = max(lens)
+        self.addr_list = addrs
+        self.lower_addr = addrs[0]
+        self.higher_addr = addrs[-1] + lens[-1] - 1
+        self.addrFormat = f"{{0:0>{self.max_addr_len}X}}"
+
+
+    def footprint(self):
+        '''
+        return an estimation of the memory used by the data of the file, in bytes
+        '''
+        if self.lazy:
+            #index : 8 bytes of address, 8 of offset and 1 of length per line
+            return 17*len(self.data) + len(self.data.cache)*(RECORD_FOOTPRINT + self.max_data_len)
+        return len(self.data)*(RECORD_FOOTPRINT + self.max_data_len)
+
+    def load_layout(self, layout):
+        '''
+        Build the SRecords of the file from an ImageLayout (see SRecordCache)
+        The lines cover the segments exactly and are sorted : the data of the lines
+        is cut out of the segments joined, one after the other
+        '''
+        self.header = collections.OrderedDict((srec.address_u, srec) for srec in layout.header)
+        self.footer = collections.OrderedDict((srec.address_u, srec) for srec in layout.footer)
+        joined = b''.join(layout.segments)
+        ends = list(accumulate(layout.line_lens))
+        datas = map(joined.__getitem__, map(slice, chain([0], ends), ends))
+        types = map('S{:c}'.format, layout.line_types)
+        srecords = map(sr.SRecord.from_fields, types, layout.line_addrs, datas, layout.line_cks, layout.line_offsets)
+        self.data = collections.OrderedDict(zip(layout.line_addrs, srecords))
+        self.sectors = [Sector(start=start, end=end) for start, end in layout.sectors]
+        self.start = self.sectors[-1].start
+
+        self.max_addr_len = 2*max(sr.SRecord.ADDR_LEN['S' + chr(s_type)] for s_type in set(layout.line_types))
+        self.max_data_len = max(layout.line_lens)
+        self.addr_list = list(layout.line_addrs)
+        self.lower_addr = self.addr_list[0]
+        self.higher_addr = self.addr_list[-1] + layout.line_lens[-1] - 1
+        self.addrFormat = f"{{0:0>{self.max_addr_len}X}}"
+
+    def image_layout(self):
+        '''
+        return the ImageLayout of the file (see SRecordCache)
+        '''
+        data = list(self.data.values())
+        pieces = list(self.iter_sector_data())
+        return src.ImageLayout(header=list(self.header.values()), footer=list(self.footer.values()), sectors=self.sectors,
+                               line_addrs=array('Q', (srec.address_u for srec in data)),
+                               line_offsets=array('Q', (srec.offset for srec in data)),
+                               line_lens=bytes(len(srec.data) for srec in data),
+                               line_types=bytes(ord(srec.s_type[1]) for srec in data),
+                               line_cks=bytes(srec.checksum_u for srec in data),
+                               seg_starts=[start for start, piece in pieces], segments=[piece for start, piece in pieces])
 
     def get_file_infos(self):
         file_infos = 20*'-' + '\n'
@@ -82,6 +780,13 @@ class SRecordFile:
         footers = list(self.footer.values())
         return (item for item in (headers + datas + footers))
 
+    def iter_sector_data(self):
+        '''
+        Generator of (start address, data) for each range of contiguous data of the
+        file, in address order. The data of a range is joined in one bytes object.
+        '''
+        return join_pieces((srec.address_u, srec.data) for srec in self.data.values())
+
     def __getitem__(self, position):
         '''
         This function returns the SRec at posision if it exists
@@ -97,6 +802,7 @@ class SRecordFile:
         '''
         data_coord = self.get_data_coord(position)
         self[data_coord.line][data_coord.idx] = value
+        self.dirty.add(self[data_coord.line])
 
     def get_data_coord(self, position):
         '''
@@ -108,6 +814,9 @@ class SRecordFile:
         elif position > self.higher_addr:
             raise AccessSrecFileError("get_data_coord is being given an address too high")
         else:
+            if srs.stats.enabled:
+                srs.stats.count(srs.LOOKUPS)
+                srs.stats.count(srs.BISECT_CALLS)
             addr_line = self.addr_list[bisect_right(self.addr_list, position) - 1]
             if position <= self.data[addr_line].end_address():
                 addr_byte = position - addr_line
@@ -115,31 +824,224 @@ class SRecordFile:
             else:
                 raise AccessSrecFileError("get_data_coord is being fiven an address in-between two sectors")
 
+    def range_srecords(self, address, size):
+        '''
+        Input : address and size of a range of data, integers
+        Output : a list of (SRecord, offset in the SRecord, offset in the range, size)
+                 covering the range, in address order
+        The range can go over several SRecords, but not over a gap between two sectors
+        '''
+        idx = bisect_right(self.addr_list, self.get_data_coord(address).line) - 1
+        srs.stats.count(srs.BISECT_CALLS)
+        pieces = []
+        range_offset = 0
+        while range_offset < size:
+            if idx >= len(self.addr_list) or self.addr_list[idx] > address + range_offset:
+                raise AccessSrecFileError("The range goes over a gap between two sectors")
+            srec = self.data[self.addr_list[idx]]
+            srec_offset = address + range_offset - srec.address_u
+            piece_size = min(len(srec.data) - srec_offset, size - range_offset)
+            pieces.append((srec, srec_offset, range_offset, piece_size))
+            range_offset += piece_size
+            idx += 1
+        return pieces
+
+    def read_range(self, address, size):
+        '''
+        return size bytes starting at address, as bytes
+        '''
+        return b''.join(srec.data[srec_offset:srec_offset + piece_size] for srec, srec_offset, range_offset, piece_size in self.range_srecords(address, size))
+
+    def write_range(self, address, data):
+        '''
+        Write the bytes of data starting at address, see write_many
+        '''
+        self.write_many([(address, data)])
+
+    def write_many(self, writes):
+        '''
+        Input : writes, a list of (address, data) with data a bytes-like object
+        Every range is checked before anything is written. The data is copied with
+        slice assignments, grouped by SRecord, and the checksum of each SRecord
+        touched is computed once, whatever the number of bytes written in it.
+        '''
+        plans = [(memoryview(data), self.range_srecords(address, len(data))) for address, data in writes]
+        touched = {}
+        for data, pieces in plans:
+            for srec, srec_offset, range_offset, piece_size in pieces:
+                srec.data[srec_offset:srec_offset + piece_size] = data[range_offset:range_offset + piece_size]
+                touched[srec.address_u] = srec
+        for srec in touched.values():
+            srec.update_checksum()
+        srs.stats.count(srs.CHECKSUMS, len(touched))
+        self.dirty.update(touched.values())
+
+    def overlay(self, source, offset = 0, start = None):
+        '''
+        Copy the data of another image into this one, address by address
+            Input   * source : SRecordFile, SRecordImage or SRecordStream
+                    * offset : added to the source addresses (relocation)
+                    * start : if given, the source is relocated so that its lower
+                      address lands on start, and offset is not used
+        The gaps of the source are kept : each of its ranges of contiguous data is
+        written as one buffer. Every range is checked before anything is written.
+        Output : the number of bytes written
+        '''
+        writes = overlay_writes(source, offset, start)
+        self.write_many(writes)
+        return sum(len(data) for address, data in writes)
+
     def patch_SRecord_File(self, position, value):
         '''
         Input : position is an address inside the file, hexadecimal format
                 value : the new value of the data, hexadecimal format
         Output : None, self will be updated
         '''
-        pos = sr.INT(position)
-        if len(value)%2 != 0:
-            raise SRecordFileError("Patching requieres full byte data, i.e. an even number of char")
-        data_coord = self.get_data_coord(pos)
-        patching_bytes = [value[i-2:i] for i in range(len(value), 0, -2)]
-        while patching_bytes:
-            self[data_coord.line][data_coord.idx] = patching_bytes.pop()
-            pos +=1
-            data_coord = self.get_data_coord(pos)
+        self.write_range(*hex_patch(position, value))
+
+    def verify_checksums(self):
+        '''
+        Check the checksums of every data SRecord, computed by batches of SRecords
+        Output : the sorted list of the addresses of the lines with a wrong checksum
+        '''
+        bad_lines = []
+        srecords = iter(self.data.values())
+        batch = list(islice(srecords, CHECKSUM_BATCH))
+        while batch:
+            bad_lines += [srec.address_u for srec in compress(batch, sr.wrong_checksums(batch))]
+            srs.stats.count(srs.CHECKSUMS, len(batch))
+            batch = list(islice(srecords, CHECKSUM_BATCH))
+        return bad_lines
+
+    def fix_checksums(self):
+        '''
+        Update the wrong checksums of the file, headers and footers included
+        Output : a list of (SRecord fixed, its former checksum as an integer)
+        '''
+        fixed = [self.data[line_addr] for line_addr in self.verify_checksums()]
+        others = list(self.header.values()) + list(self.footer.values())
+        fixed += compress(others, sr.wrong_checksums(others))
+        changes = [(srec, srec.checksum_u) for srec in fixed]
+        for srec in fixed:
+            srec.update_checksum()
+        srs.stats.count(srs.CHECKSUMS, len(others) + len(fixed))
+        self.set_checksums([(srec, srec.checksum_u) for srec in fixed])
+        return changes
+
+    def set_checksums(self, checksums):
+        '''
+        Input : checksums, a list of (SRecord of the file, checksum as an integer)
+        '''
+        for srec, checksum_u in checksums:
+            srec.checksum_u = checksum_u
+            self.dirty.add(srec)
+
+    ##########################################################################
+    # Saving : a modified SRecord keeps the length of its line, so the dirty
+    # lines can be written in place, at their offset, without touching the others
+    ##########################################################################
+
+    def has_changes(self):
+        return bool(self.dirty)
+
+    def iter_dirty_lines(self):
+        '''
+        Generator of (offset, text) of the lines modified since the last save
+        '''
+        for srec in self.dirty:
+            yield srec.offset, srec.to_string()
+
+    def can_save_in_place(self):
+        '''
+        The lines can be written in place if the file was not modified by someone
+        else since it was read, and if the offset of every dirty line is known
+        '''
+        return (os.path.exists(self.path) and file_stat(self.path) == self.file_stat
+                and all(srec.offset is not None for srec in self.dirty))
+
+    def save(self, in_place = True):
+        '''
+        Write the changes to the file at self.path
+        Only the dirty lines are written, in place, when it is possible (see
+        can_save_in_place) and in_place is set. Otherwise the whole file is written
+        aside and then replaces the file.
+        Output : True if the lines were written in place, False if the whole file was
+                 written, None if there was nothing to save
+        '''
+        if in_place and not self.has_changes():
+            return None
+        with srs.stats.timer('save'):
+            in_place = in_place and self.can_save_in_place()
+            if in_place:
+                with open(self.path, 'r+b') as srec_f:
+                    for offset, line in sorted(self.iter_dirty_lines()):
+                        srec_f.seek(offset)
+                        srs.stats.count(srs.BYTES_WRITTEN, srec_f.write(line.encode('ascii')))
+            else:
+                self.rewrite()
+            self.mark_saved()
+        return in_place
+
+    def rewrite(self):
+        '''
+        Write the whole file aside, then replace the file at self.path with it (the
+        lines not parsed yet by a lazy file are read from the mapped file : it can't
+        be overwritten while we read it) and update the offsets of the lines
+        '''
+        tmp_fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        os.close(tmp_fd)
+        try:
+            self.write_file(tmp_name)
+            if os.path.exists(self.path):
+                shutil.copymode(self.path, tmp_name)
+        except BaseException:
+            os.remove(tmp_name)
+            raise
+        if self.lazy:
+            self.data.buffer.close()
+        os.replace(tmp_name, self.path)
+        self.update_offsets()
+
+    def update_offsets(self):
+        '''
+        Set the offsets of the lines, as they were written by write_file
+        '''
+        if self.lazy:
+            #the index is built again, the SRecords already parsed are kept
+            header, footer, cache = self.header, self.footer, self.data.cache
+            self.load_index(self.path)
+            for old_srec, new_srec in zip(chain(header.values(), footer.values()), chain(self.header.values(), self.footer.values())):
+                old_srec.offset = new_srec.offset
+            for address, srec in cache.items():
+                srec.offset = self.data.offsets[self.data.index(address)]
+            self.header, self.footer, self.data.cache = header, footer, cache
+            return
+        #lines are written in text mode, '\n' becomes os.linesep
+        offset = 0
+        for srec in chain(self.header.values(), self.data.values(), self.footer.values()):
+            srec.offset = offset
+            offset += srec.line_len() + len(os.linesep)
+
+    def mark_saved(self):
+        self.dirty.clear()
+        self.file_stat = file_stat(self.path)
+        self.modified = True
+
+    def write_file(self, name):
+        '''
+        Write every SRecord into the file name
+        '''
+        with SRecordWriter(name) as writer:
+            writer.write_all(self.header.values())
+            writer.write_all(self.data.values())
+            writer.write_all(self.footer.values())
 
     def export(self, name):
         '''
         This function write the SRecFile Object into a .s19 file
+        Exporting to the file itself rewrites it as a whole (see save)
         '''
-        with open(name, 'w+') as SRec_f:
-            for addr in self.header:
-                SRec_f.write(self.header[addr].to_string(end='\n'))
-            for addr in self.data:
-                SRec_f.write(self.data[addr].to_string(end='\n'))
-            for addr in self.footer:
-                SRec_f.write(self.footer[addr].to_string(end='\n'))
-
+        if os.path.exists(name) and os.path.samefile(name, self.path):
+            self.save(in_place=False)
+        else:
+            self.write_file(name)
\ No newline at end of file
@@ -0,0 +1,611 @@
+import SRecord as sr
+import SRecordCache as src
+import SRecordConvert as srcv
+import SRecordFile as srf
+import SRecordStats as srs
+import collections
+import os
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
+from itertools import accumulate, chain, compress, repeat
+from operator import add, gt
+
+def max_data_len(line_type):
+    '''
+    return the maximal number of data bytes of a line of type line_type ('1', '2' or '3' as an integer)
+    '''
+    return 0xFF - sr.SRecord.ADDR_LEN['S' + chr(line_type)] - 1
+
+def split_long_lines(addrs, lens, types, cks):
+    '''
+    Cut the lines holding more data than their type allows (a line whose type was
+    widened) in lines of the maximal length
+    Output : the addresses, lengths, types and checksums of the lines
+    '''
+    if not lens or max(lens) <= max_data_len(max(types)):
+        return addrs, lens, types, cks
+    lines = []
+    for address, length, s_type, checksum in zip(addrs, lens, types, cks):
+        if length <= max_data_len(s_type):
+            lines.append((address, length, s_type, checksum))
+            continue
+        for offset, size in srcv.iter_lines_cuts(address, length, max_data_len(s_type)):
+            lines.append((address + offset, size, s_type, 0))
+    addrs, lens, types, cks = zip(*lines)
+    return array('Q', addrs), array('B', lens), bytearray(types), bytes(cks)
+
+class ImageLines(Mapping):
+    '''
+    Read only view of the data lines of an SRecordImage, keyed by line address.
+    Each access builds a new SRecord from the segment buffers : modifying it does
+    not modify the image, use SRecordImage.write_range for that.
+    '''
+    def __init__(self, image):
+        self.image = image
+
+    def __getitem__(self, address):
+        idx = bisect_left(self.image.line_addrs, address)
+        if idx == len(self.image.line_addrs) or self.image.line_addrs[idx] != address:
+            raise KeyError(address)
+        return self.image.build_line(idx)
+
+    def __len__(self):
+        return len(self.image.line_addrs)
+
+    def __iter__(self):
+        return iter(self.image.line_addrs)
+
+class SRecordImage(srf.SRecordFile):
+    '''
+    Flat memory image of an SRecord file.
+    Each contiguous Sector is kept as one bytearray segment, in a table sorted by
+    start address, so reading or writing a range is a bisect and a slice operation.
+    The data SRecords are only rebuilt when they are needed, following the original
+    line layout (line address, data length, type and checksum).
+    The data lines written since the last save are kept by index in self.dirty_lines.
+    '''
+
+    #layout of the cache files of the class : sectors in address order, S5 SRecords in the footer
+    CACHE_KIND = 'image'
+
+    @classmethod
+    def from_file(cls, file):
+        '''
+        Build an SRecordImage from the SRecords of an SRecordFile (its current state),
+        without reading the file again
+        '''
+        image = cls.__new__(cls)
+        image.path = file.path
+        image.name = file.name
+        image.lazy = False
+        image.workers = file.workers
+        image.dirty = set()
+        image.file_stat = file.file_stat
+        image.modified = file.modified
+        image.digest = file.digest
+        image.load_srecords(iter(file))
+        if file.has_changes():
+            #the lines modified are not known anymore, the whole file will be written
+            image.line_offsets = None
+        return image
+
+    def load_srecords(self, srecords, sectors = None):
+        '''
+        Build the segment table and the line layout from an iterable of SRecord
+        (the sectors are always found from the segments, sectors is ignored)
+        '''
+        self.header  = collections.OrderedDict()
+        self.footer  = collections.OrderedDict()
+        data = []
+        for crt_srec in srecords:
+            if crt_srec.s_type in srf.HEADER_TYPES:
+                self.header[crt_srec.address_u] = crt_srec
+            elif crt_srec.s_type in ('S1', 'S2', 'S3'):
+                data.append(crt_srec)
+            else:
+                self.footer[crt_srec.address_u] = crt_srec
+        data.sort()
+
+        #line layout : address, data length and type ('1', '2' or '3') of each data line
+        self.line_addrs = array('Q')
+        self.line_lens  = array('B')
+        self.line_types = bytearray()
+        #checksums of the lines, as they are in the file once saved (see build_line)
+        self.line_cks   = bytearray()
+        #segment table : sorted start addresses and their buffers
+        self.seg_starts = []
+        self.segments   = []
+        self.dirty_lines = set()
+        #checksums given to data lines by set_checksums, by index
+        self.pinned_cks = {}
+        for crt_srec in data:
+            if self.segments and crt_srec.address_u < self.seg_starts[-1] + len(self.segments[-1]):
+                raise srf.SRecordFileError(f"Overlapping SRecords at address 0x{crt_srec.address_h}")
+            if self.segments and crt_srec.address_u == self.seg_starts[-1] + len(self.segments[-1]):
+                self.segments[-1] += crt_srec.data
+            else:
+                self.seg_starts.append(crt_srec.address_u)
+                self.segments.append(bytearray(crt_srec.data))
+            self.line_addrs.append(crt_srec.address_u)
+            self.line_lens.append(len(crt_srec.data))
+            self.line_types.append(ord(crt_srec.s_type[1]))
+            self.line_cks.append(crt_srec.checksum_u)
+        if not self.segments:
+            raise srf.SRecordFileError("No data SRecord found")
+        #offsets of the data lines in the file, None if some of them are unknown
+        offsets = [crt_srec.offset for crt_srec in data]
+        self.line_offsets = None if None in offsets else array('Q', offsets)
+        self.update_layout()
+
+    def load_lines(self, lines):
+        '''
+        Build the segment table straight from the data of a ChunkLines (see
+        SRecordFile.load_parallel) when its lines are sorted, without any SRecord
+        '''
+        if any(map(gt, lines.addrs, lines.addrs[1:])):
+            return super().load_lines(lines)
+        seg_starts, seg_lens = [], []
+        end = None
+        for address, length, s_type in zip(lines.addrs, lines.lens, lines.types):
+            if end is not None and address < end:
+                addr_len = sr.SRecord.ADDR_LEN['S' + chr(s_type)]
+                raise srf.SRecordFileError(f"Overlapping SRecords at address 0x{address:0{2*addr_len}X}")
+            if address == end:
+                seg_lens[-1] += length
+            else:
+                seg_starts.append(address)
+                seg_lens.append(length)
+            end = address + length
+        if not seg_starts:
+            raise srf.SRecordFileError("No data SRecord found")
+        ends = list(accumulate(seg_lens))
+        segments = list(map(bytearray, map(lines.data.__getitem__, map(slice, chain([0], ends), ends))))
+        header = [srec for srec in lines.others if srec.s_type in srf.HEADER_TYPES]
+        footer = [srec for srec in lines.others if srec.s_type not in srf.HEADER_TYPES]
+        self.load_layout(src.ImageLayout(header=header, footer=footer, sectors=None, line_addrs=lines.addrs,
+                                         line_offsets=lines.offsets, line_lens=array('B', lines.lens), line_types=lines.types,
+                                         line_cks=lines.cks, seg_starts=seg_starts, segments=segments))
+
+    def load_layout(self, layout):
+        '''
+        Take the segment table and the line layout of an ImageLayout (see SRecordCache)
+        '''
+        self.header = collections.OrderedDict((srec.address_u, srec) for srec in layout.header)
+        self.footer = collections.OrderedDict((srec.address_u, srec) for srec in layout.footer)
+        self.line_addrs = layout.line_addrs
+        self.line_lens  = layout.line_lens
+        self.line_types = bytearray(layout.line_types)
+        self.line_cks   = bytearray(layout.line_cks)
+        self.line_offsets = layout.line_offsets
+        self.seg_starts = layout.seg_starts
+        self.segments   = layout.segments
+        self.dirty_lines = set()
+        self.pinned_cks = {}
+        self.update_layout()
+
+    def image_layout(self):
+        '''
+        return the ImageLayout of the image (see SRecordCache)
+        '''
+        return src.ImageLayout(header=list(self.header.values()), footer=list(self.footer.values()), sectors=self.sectors,
+                               line_addrs=self.line_addrs, line_offsets=self.line_offsets, line_lens=self.line_lens,
+                               line_types=self.line_types, line_cks=self.line_cks,
+                               seg_starts=self.seg_starts, segments=self.segments)
+
+    def load_index(self, file_name):
+        raise srf.SRecordFileError("An SRecordImage keeps all its data in memory, it can't be loaded lazily")
+
+    def update_layout(self):
+        '''
+        Refresh the attributes derived from the segment table and the line layout
+        '''
+        self.data = ImageLines(self)
+        self.addr_list = self.line_addrs
+        self.sectors = [srf.Sector(start=start, end=start + len(seg) - 1) for start, seg in zip(self.seg_starts, self.segments)]
+        self.start = self.seg_starts[0]
+        self.lower_addr = self.sectors[0].start
+        self.higher_addr = self.sectors[-1].end
+        self.max_addr_len = 2*max(sr.SRecord.ADDR_LEN['S' + chr(s_type)] for s_type in set(self.line_types))
+        self.max_data_len = max(self.line_lens)
+        self.addrFormat = f"{{0:0>{self.max_addr_len}X}}"
+
+    def footprint(self):
+        '''
+        return an estimation of the memory used by the data of the image, in bytes
+        '''
+        #line layout : 8 bytes of address, 8 of offset, 1 of length, type and checksum per line
+        return sum(map(len, self.segments)) + 19*len(self.line_addrs)
+
+    def locate(self, address, size = 1):
+        '''
+        Input : address and size of a range, integers
+        Output : index of the segment containing the whole range, offset of address in it
+        '''
+        if srs.stats.enabled:
+            srs.stats.count(srs.LOOKUPS)
+            srs.stats.count(srs.BISECT_CALLS)
+        seg_idx = bisect_right(self.seg_starts, address) - 1
+        if seg_idx < 0:
+            raise srf.AccessSrecFileError("Address too low for this image")
+        offset = address - self.seg_starts[seg_idx]
+        if offset + size > len(self.segments[seg_idx]):
+            raise srf.AccessSrecFileError("Range is not inside a sector of the image")
+        return seg_idx, offset
+
+    def read_range(self, address, size):
+        '''
+        return size bytes starting at address, as bytes
+        '''
+        seg_idx, offset = self.locate(address, size)
+        return bytes(self.segments[seg_idx][offset:offset + size])
+
+    def write_range(self, address, data):
+        '''
+        write the bytes of data starting at address, the range must be inside a sector
+        '''
+        self.write_many([(address, data)])
+
+    def write_many(self, writes):
+        '''
+        Input : writes, a list of (address, data) with data a bytes-like object
+        Every range is checked before anything is written
+        '''
+        plans = [(self.locate(address, len(data)), data) for address, data in writes]
+        for (seg_idx, offset), data in plans:
+            self.segments[seg_idx][offset:offset + len(data)] = data
+        for address, data in writes:
+            first = bisect_right(self.line_addrs, address) - 1
+            last = bisect_right(self.line_addrs, address + len(data) - 1)
+            self.dirty_lines.update(range(first, last))
+            if self.pinned_cks:
+                for idx in range(first, last):
+                    self.pinned_cks.pop(idx, None)
+
+    def iter_sector_data(self):
+        '''
+        Generator of (start address, data) for each segment of the image, the
+        segment buffers themselves are given : they must not be resized
+        '''
+        return zip(self.seg_starts, self.segments)
+
+    def build_line(self, idx):
+        '''
+        return the SRecord of the data line number idx, rebuilt from the segment table
+        The checksum is the one of the line in the file, unless the line is to be written
+        again : it is then computed, or the one given by set_checksums
+        '''
+        address = self.line_addrs[idx]
+        seg_idx, offset = self.locate(address, self.line_lens[idx])
+        data = self.segments[seg_idx][offset:offset + self.line_lens[idx]]
+        return sr.SRecord.from_fields('S' + chr(self.line_types[idx]), address, data, self.line_checksum(idx))
+
+    def line_checksum(self, idx):
+        '''
+        return the checksum the data line number idx is written with : the one given by
+        set_checksums, or the one of the line in the file, None if it is to be computed
+        (the line was written, or the whole file is to be written after a layout change)
+        '''
+        if idx in self.pinned_cks:
+            return self.pinned_cks[idx]
+        if self.line_offsets is None or idx in self.dirty_lines:
+            return None
+        return self.line_cks[idx]
+
+    def iter_lines(self, end = '\n'):
+        '''
+        generator of the text of every data line, in address order, with the checksum
+        given by line_checksum
+        '''
+        seg_idx = 0
+        seg_end = self.seg_starts[0] + len(self.segments[0])
+        checksums = map(self.line_checksum, range(len(self.line_addrs)))
+        for address, length, s_type, checksum_u in zip(self.line_addrs, self.line_lens, self.line_types, checksums):
+            #lines are sorted and never cross a segment boundary
+            while address >= seg_end:
+                seg_idx += 1
+                seg_end = self.seg_starts[seg_idx] + len(self.segments[seg_idx])
+            offset = address - self.seg_starts[seg_idx]
+            yield sr.format_srec('S' + chr(s_type), address, self.segments[seg_idx][offset:offset + length], end, checksum_u)
+
+    def get_data_coord(self, position):
+        '''
+        Input : position is an address inside the file, integer format
+        Output : a Coord named tuple, with line and idx
+        '''
+        if position < self.lower_addr:
+            raise srf.AccessSrecFileError("get_data_coord is being given an address too low")
+        elif position > self.higher_addr:
+            raise srf.AccessSrecFileError("get_data_coord is being given an address too high")
+        idx = bisect_right(self.line_addrs, position) - 1
+        if position < self.line_addrs[idx] + self.line_lens[idx]:
+            return srf.Coord(line=self.line_addrs[idx], idx=position - self.line_addrs[idx])
+        raise srf.AccessSrecFileError("get_data_coord is being fiven an address in-between two sectors")
+
+    def verify_checksums(self):
+        '''
+        Check the stored checksums of every data line, computed by batches of lines
+        Output : the sorted list of the addresses of the lines with a wrong checksum
+        '''
+        if self.line_offsets is None:
+            #the whole file will be written again, with fresh checksums
+            return []
+        bad_lines = []
+        for first in range(0, len(self.line_addrs), srf.CHECKSUM_BATCH):
+            batch = [self.build_line(idx) for idx in range(first, min(first + srf.CHECKSUM_BATCH, len(self.line_addrs)))]
+            bad_lines += [srec.address_u for srec in compress(batch, sr.wrong_checksums(batch))]
+            srs.stats.count(srs.CHECKSUMS, len(batch))
+        return bad_lines
+
+    def set_checksums(self, checksums):
+        '''
+        Input : checksums, a list of (SRecord of the file, checksum as an integer)
+        The data lines are given by SRecords built by the image (see build_line) : they
+        are written again with that checksum when the image is saved
+        '''
+        others = []
+        for srec, checksum_u in checksums:
+            if srec.s_type in ('S1', 'S2', 'S3'):
+                idx = bisect_left(self.line_addrs, srec.address_u)
+                self.pinned_cks[idx] = checksum_u
+                self.dirty_lines.add(idx)
+            else:
+                others.append((srec, checksum_u))
+        super().set_checksums(others)
+
+    def __setitem__(self, position, value):
+        '''
+        This function set the byte at address "position" to "value"
+        (a string of at most 2 hexadecimal digits, see sr.hex_byte)
+        '''
+        self.write_range(position, bytes([sr.hex_byte(value, "SRecordImage class: __setitem__")]))
+
+    ##########################################################################
+    # Segment operations : sectors are moved, merged or cut as whole buffers,
+    # the line layout follows with array slices, no SRecord is ever built
+    ##########################################################################
+
+    def segment_index(self, start):
+        '''
+        return the index of the segment starting at start
+        '''
+        seg_idx = bisect_left(self.seg_starts, start)
+        if seg_idx == len(self.seg_starts) or self.seg_starts[seg_idx] != start:
+            raise srf.AccessSrecFileError(f"No sector starts at address 0x{start:X}")
+        return seg_idx
+
+    def overlapping_segments(self, start, end):
+        '''
+        return the range of the indexes of the segments holding data between start and end
+        '''
+        first = bisect_right(self.seg_starts, start) - 1
+        if first < 0 or self.seg_starts[first] + len(self.segments[first]) <= start:
+            first += 1
+        return range(first, bisect_right(self.seg_starts, end))
+
+    def insert_lines(self, addrs, lens, types, cks):
+        '''
+        insert sorted lines in the line layout, they must not overlap the other ones
+        '''
+        idx = bisect_left(self.line_addrs, addrs[0]) if addrs else 0
+        self.line_addrs[idx:idx] = addrs
+        self.line_lens[idx:idx] = lens
+        self.line_types[idx:idx] = types
+        self.line_cks[idx:idx] = cks
+
+    def pop_lines(self, first, last):
+        '''
+        remove the lines first to last (excluded) from the line layout
+        Output : their addresses, lengths, types and checksums
+        '''
+        lines = (self.line_addrs[first:last], self.line_lens[first:last], self.line_types[first:last], self.line_cks[first:last])
+        for layout in (self.line_addrs, self.line_lens, self.line_types, self.line_cks):
+            del layout[first:last]
+        return lines
+
+    def join_segments(self, seg_idx):
+        '''
+        merge the segment seg_idx with the next one if they are contiguous
+        '''
+        if seg_idx + 1 < len(self.segments) and self.seg_starts[seg_idx] + len(self.segments[seg_idx]) == self.seg_starts[seg_idx + 1]:
+            self.segments[seg_idx] += self.segments.pop(seg_idx + 1)
+            del self.seg_starts[seg_idx + 1]
+
+    def layout_changed(self):
+        '''
+        Lines were moved, added or removed : the footer SRecords take the address width
+        of the widest data SRecords, the count SRecord is updated, and the file will be
+        written as a whole when it is saved
+        '''
+        footer_type = srcv.FOOTER_OF['S' + chr(max(self.line_types))]
+        footer = collections.OrderedDict()
+        for address, srec in self.footer.items():
+            if srec.s_type in srf.FOOTER_TYPES and srec.addr_len('byte') < sr.SRecord.ADDR_LEN[footer_type]:
+                srec = sr.SRecord.from_fields(footer_type, address, srec.data)
+            elif srec.s_type == 'S5':
+                address = len(self.line_addrs) & 0xFFFF
+                srec = sr.SRecord.from_fields('S5', address, b'')
+            footer[address] = srec
+        self.footer = footer
+        self.line_offsets = None
+        self.dirty_lines.clear()
+        self.pinned_cks.clear()
+        self.update_layout()
+
+    def remap_sector(self, start, new_start):
+        '''
+        Move the sector starting at start to new_start : its segment buffer is moved as
+        a whole, its lines are shifted (their type is widened if their new address needs
+        it, a line too long for its new type is cut). The new range must not overlap
+        another sector, it is merged with the sectors it touches.
+        '''
+        seg_idx = self.segment_index(start)
+        size = len(self.segments[seg_idx])
+        if new_start < 0:
+            raise srf.AccessSrecFileError("A sector can't start at a negative address")
+        try:
+            new_type = ord(srcv.smallest_type(new_start + size - 1)[1])
+        except srcv.ConvertError as e:
+            raise srf.SRecordFileError(str(e))
+        conflicts = [idx for idx in self.overlapping_segments(new_start, new_start + size - 1) if idx != seg_idx]
+        if conflicts:
+            raise srf.SRecordFileError(f"The sector would overlap the sector starting at 0x{self.seg_starts[conflicts[0]]:X}")
+
+        segment = self.segments.pop(seg_idx)
+        del self.seg_starts[seg_idx]
+        addrs, lens, types, cks = self.pop_lines(bisect_left(self.line_addrs, start), bisect_left(self.line_addrs, start + size))
+        addrs = array('Q', map(add, addrs, repeat(new_start - start)))
+        types = bytearray(max(s_type, new_type) for s_type in types)
+        self.insert_lines(*split_long_lines(addrs, lens, types, cks))
+
+        seg_idx = bisect_left(self.seg_starts, new_start)
+        self.seg_starts.insert(seg_idx, new_start)
+        self.segments.insert(seg_idx, segment)
+        self.join_segments(seg_idx)
+        if seg_idx > 0:
+            self.join_segments(seg_idx - 1)
+        self.layout_changed()
+
+    def gap_line_type(self, seg_idx):
+        '''
+        return the type of the lines filling the gap before the segment seg_idx : the
+        type of the line before the gap, widened if the end of the gap needs it
+        '''
+        prev_type = self.line_types[bisect_left(self.line_addrs, self.seg_starts[seg_idx]) - 1]
+        return max(prev_type, ord(srcv.smallest_type(self.seg_starts[seg_idx] - 1)[1]))
+
+    def fill_gaps(self, start, end, fill = 0xFF, data_len = None):
+        '''
+        Merge the sectors found between start and end in one, the gaps between them
+        being filled with the byte fill. The lines added hold data_len bytes (by default,
+        as many as the line before the gap, cut if their type is widened) and have the type
+        of the line before the gap, widened if the end of the gap needs it.
+        Output : the number of bytes added
+        '''
+        segs = self.overlapping_segments(start, end)
+        if len(segs) < 2:
+            return 0
+        gap_types = {seg_idx: self.gap_line_type(seg_idx) for seg_idx in segs[1:]}
+        if data_len is not None:
+            widest = max(gap_types.values())
+            if not 0 < data_len <= max_data_len(widest):
+                raise srf.SRecordFileError(f"An S{widest:c} SRecord holds 1 to {max_data_len(widest)} data bytes")
+        first = segs[0]
+        added = 0
+        for seg_idx in segs[1:]:
+            gap_start = self.seg_starts[first] + len(self.segments[first])
+            gap_len = self.seg_starts[seg_idx] - gap_start
+            prev_line = bisect_left(self.line_addrs, gap_start) - 1
+            crt_len = data_len or self.line_lens[prev_line]
+            addrs = array('Q', range(gap_start, gap_start + gap_len, crt_len))
+            lens = array('B', repeat(crt_len, len(addrs)))
+            lens[-1] = gap_start + gap_len - addrs[-1]
+            self.insert_lines(*split_long_lines(addrs, lens, bytearray([gap_types[seg_idx]])*len(addrs), bytes(len(addrs))))
+            self.segments[first] += bytes([fill])*gap_len
+            self.segments[first] += self.segments[seg_idx]
+            added += gap_len
+        del self.segments[first + 1:segs[-1] + 1]
+        del self.seg_starts[first + 1:segs[-1] + 1]
+        self.layout_changed()
+        return added
+
+    def trim(self, start, end):
+        '''
+        Remove the data found between start and end : segments and lines going over a
+        bound are cut
+        Output : the number of bytes removed
+        '''
+        segs = self.overlapping_segments(start, end)
+        if not segs:
+            return 0
+        if len(segs) == len(self.segments) and start <= self.seg_starts[0] and end >= self.higher_addr:
+            raise srf.SRecordFileError("Trimming every data of the file is not possible")
+        removed = 0
+        for seg_idx in reversed(segs):
+            seg_start = self.seg_starts[seg_idx]
+            segment = self.segments[seg_idx]
+            pieces = []
+            if seg_start < start:
+                pieces.append((seg_start, segment[:start - seg_start]))
+            if seg_start + len(segment) - 1 > end:
+                pieces.append((end + 1, segment[end + 1 - seg_start:]))
+            removed += len(segment) - sum(len(piece) for piece_start, piece in pieces)
+            self.seg_starts[seg_idx:seg_idx + 1] = [piece_start for piece_start, piece in pieces]
+            self.segments[seg_idx:seg_idx + 1] = [piece for piece_start, piece in pieces]
+
+        first = bisect_right(self.line_addrs, start) - 1
+        if first < 0 or self.line_addrs[first] + self.line_lens[first] <= start:
+            first += 1
+        addrs, lens, types, cks = self.pop_lines(first, bisect_right(self.line_addrs, end))
+        kept = []
+        #only the first and the last lines can go over a bound
+        for address, length, s_type, checksum in zip(addrs, lens, types, cks):
+            if address < start:
+                kept.append((address, start - address, s_type, 0))
+            if address + length - 1 > end:
+                kept.append((end + 1, address + length - 1 - end, s_type, 0))
+        if kept:
+            kept_addrs, kept_lens, kept_types, kept_cks = zip(*kept)
+            self.insert_lines(array('Q', kept_addrs), array('B', kept_lens), bytes(kept_types), bytes(kept_cks))
+        self.layout_changed()
+        return removed
+
+    def has_changes(self):
+        return bool(self.dirty or self.dirty_lines or self.line_offsets is None)
+
+    def iter_dirty_lines(self):
+        '''
+        Generator of (offset, text) of the lines modified since the last save
+        '''
+        yield from super().iter_dirty_lines()
+        srs.stats.count(srs.CHECKSUMS, len(self.dirty_lines))
+        for idx in self.dirty_lines:
+            yield self.line_offsets[idx], self.build_line(idx).to_string()
+
+    def can_save_in_place(self):
+        return self.line_offsets is not None and super().can_save_in_place()
+
+    def update_offsets(self):
+        '''
+        Set the offsets and the checksums of the lines, as they were written by write_file
+        '''
+        eol = len(os.linesep)
+        offset = 0
+        for srec in self.header.values():
+            srec.offset = offset
+            offset += srec.line_len() + eol
+        self.line_cks = self.written_cks
+        self.dirty_lines.clear()
+        self.pinned_cks.clear()
+        line_base = {s_type: 6 + 2*sr.SRecord.ADDR_LEN['S' + chr(s_type)] + eol for s_type in set(self.line_types)}
+        self.line_offsets = array('Q')
+        for length, s_type in zip(self.line_lens, self.line_types):
+            self.line_offsets.append(offset)
+            offset += line_base[s_type] + 2*length
+        for srec in self.footer.values():
+            srec.offset = offset
+            offset += srec.line_len() + eol
+
+    def mark_saved(self):
+        super().mark_saved()
+        #the lines written in place keep the checksum they were written with
+        for idx in self.dirty_lines:
+            self.line_cks[idx] = self.build_line(idx).checksum_u
+        self.dirty_lines.clear()
+        self.pinned_cks.clear()
+
+    def write_file(self, name):
+        '''
+        This function write the SRecordImage into a .s19 file, the lines not written since
+        they were read keep their checksum (see line_checksum)
+        '''
+        srs.stats.count(srs.CHECKSUMS, len(self.dirty_lines) if self.line_offsets is not None else len(self.line_addrs))
+        #checksums written, they become the stored ones if the file is the image's own (see update_offsets)
+        self.written_cks = bytearray()
+        with srf.SRecordWriter(name) as writer:
+            writer.write_all(self.header.values())
+            for line in self.iter_lines():
+                writer.write_line(line)
+                self.written_cks.append(int(line[-3:-1], 16))
+            writer.write_all(self.footer.values())
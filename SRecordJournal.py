@@ -0,0 +1,92 @@
+import collections
+
+#############################################################################
+# Reversible edits (command pattern) : each one keeps only what it changed,
+# so undoing or redoing it costs the size of the edit, not the size of the file
+#############################################################################
+
+class DataEdit:
+    '''
+    Data written in a file : a list of (address, old data, new data)
+    '''
+    def __init__(self, name, changes):
+        self.name = name
+        self.changes = changes
+
+    def undo(self, file):
+        file.write_many([(address, old) for address, old, new in self.changes])
+
+    def redo(self, file):
+        file.write_many([(address, new) for address, old, new in self.changes])
+
+    def __str__(self):
+        return f"{self.name} : {sum(len(new) for address, old, new in self.changes)} bytes"
+
+class ChecksumEdit:
+    '''
+    Checksums updated in a file : a list of (SRecord, old checksum, new checksum)
+    '''
+    def __init__(self, name, changes):
+        self.name = name
+        self.changes = changes
+
+    def undo(self, file):
+        file.set_checksums([(srec, old) for srec, old, new in self.changes])
+
+    def redo(self, file):
+        file.set_checksums([(srec, new) for srec, old, new in self.changes])
+
+    def __str__(self):
+        return f"{self.name} : {len(self.changes)} checksums"
+
+class Journal:
+    '''
+    Undo and redo stacks of the edits done on a file. Only the max_edits last
+    edits are kept (all of them if max_edits is None).
+    '''
+    def __init__(self, max_edits = None):
+        self.undo_stack = collections.deque(maxlen=max_edits)
+        self.redo_stack = []
+
+    def record(self, edit):
+        self.undo_stack.append(edit)
+        self.redo_stack.clear()
+        return edit
+
+    def write_many(self, file, writes, name = 'write'):
+        '''
+        Write in file (see SRecordFile.write_many) and record the edit
+        The old data is read before writing, any invalid range raises before that
+        '''
+        changes = [(address, file.read_range(address, len(data)), bytes(data)) for address, data in writes]
+        file.write_many(writes)
+        return self.record(DataEdit(name, changes))
+
+    def fix_checksums(self, file, name = 'fix_cks'):
+        '''
+        Fix the checksums of file (see SRecordFile.fix_checksums) and record the edit
+        '''
+        changes = [(srec, old, srec.checksum_u) for srec, old in file.fix_checksums()]
+        return self.record(ChecksumEdit(name, changes))
+
+    def undo(self, file):
+        '''
+        Undo the last edit, return it (None if there is nothing to undo)
+        '''
+        if not self.undo_stack:
+            return None
+        edit = self.undo_stack.pop()
+        edit.undo(file)
+        self.redo_stack.append(edit)
+        return edit
+
+    def redo(self, file):
+        '''
+        Redo the last edit undone, return it (None if there is nothing to redo)
+        '''
+        if not self.redo_stack:
+            return None
+        edit = self.redo_stack.pop()
+        edit.redo(file)
+        self.undo_stack.append(edit)
+        return edit
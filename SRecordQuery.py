@@ -0,0 +1,203 @@
+import re
+
+from operator import and_
+
+class QueryError(Exception):
+    pass
+
+#######################################################################
+# Character classes for strings detection : a byte pattern matching one
+# character, and the codec used to decode the strings found
+#######################################################################
+
+CHARSETS = {
+    'alnum'   : (rb'[0-9A-Za-z]', 'ascii'),     #numbers and letters only
+    'ascii'   : (rb'[\x20-\x7e]', 'ascii'),     #printable ASCII
+    'utf16le' : (rb'[\x20-\x7e]\x00', 'utf-16-le'),  #printable ASCII, stored on 2 bytes
+    }
+
+def strings_pattern(min_len, charset = 'alnum'):
+    '''
+    return the compiled pattern matching min_len characters (or more) of charset
+    '''
+    char_pattern = CHARSETS[charset][0]
+    return re.compile(b'(?:' + char_pattern + b'){%d,}' % min_len)
+
+def iter_strings(file, min_len = 3, charset = 'alnum'):
+    '''
+    Generator of the strings found in file, as (address, string)
+        Input   * file : SRecordFile object (or any object with iter_sector_data)
+                * min_len : minimal number of characters of a string
+                * charset : key of CHARSETS, class of characters a string is made of
+    The pattern is run over the contiguous data of each sector, a string can't go
+    over a gap between two sectors
+    '''
+    pattern = strings_pattern(min_len, charset)
+    codec = CHARSETS[charset][1]
+    for start, data in file.iter_sector_data():
+        for match in pattern.finditer(data):
+            yield start + match.start(), match.group().decode(codec)
+
+##############################################################################
+# Queries on address ranges : reading, searching and dumping are done on the
+# contiguous data of the sectors, never one SRecord at a time
+##############################################################################
+
+def iter_range(file, address, size):
+    '''
+    Generator of (address, data) of the pieces of data found in the range of size
+    bytes starting at address, in address order (there is a piece per sector)
+    '''
+    end = address + size - 1
+    for start, stop in sorted(file.sectors):
+        first, last = max(start, address), min(stop, end)
+        if first <= last:
+            yield first, file.read_range(first, last - first + 1)
+
+def read(file, address, size, fill = None):
+    '''
+    return the size bytes starting at address, as bytes, whatever the SRecords they
+    are in. The gaps between the sectors are filled with the byte fill, an exception
+    is raised if there is a gap and fill is None.
+    '''
+    pieces = []
+    crt_addr = address
+    for start, data in iter_range(file, address, size):
+        if start > crt_addr:
+            if fill is None:
+                raise QueryError(f"No data between 0x{crt_addr:X} and 0x{start - 1:X}")
+            pieces.append(bytes([fill])*(start - crt_addr))
+        pieces.append(data)
+        crt_addr = start + len(data)
+    if crt_addr < address + size:
+        if fill is None:
+            raise QueryError(f"No data between 0x{crt_addr:X} and 0x{address + size - 1:X}")
+        pieces.append(bytes([fill])*(address + size - crt_addr))
+    return b''.join(pieces)
+
+def parse_pattern(text):
+    '''
+    Input : hexadecimal string, spaces allowed, '?' standing for any digit
+            e.g. "DEAD??EF" or "12 3? 56"
+    Output : (pattern, mask) as bytes, the bits of the wildcards being 0 in both
+    '''
+    text = ''.join(text.split())
+    if not text or len(text)%2 != 0:
+        raise QueryError("A pattern is made of full bytes, i.e. an even number of char")
+    try:
+        pattern = bytes.fromhex(text.replace('?', '0'))
+        mask = bytes.fromhex(''.join('0' if char == '?' else 'F' for char in text))
+    except ValueError:
+        raise QueryError("A pattern is made of hexadecimal digits and '?'")
+    return pattern, mask
+
+def mask_regex(pattern, mask):
+    '''
+    return the compiled regex matching pattern where the bits of mask are set
+    (a lookahead, so that overlapping occurrences are found)
+    '''
+    parts = []
+    for byte, byte_mask in zip(pattern, mask):
+        if byte_mask == 0xFF:
+            parts.append(re.escape(bytes([byte])))
+        elif byte_mask == 0:
+            parts.append(b'.')
+        else:
+            values = bytes(value for value in range(256) if value & byte_mask == byte & byte_mask)
+            parts.append(b'[' + b''.join(re.escape(bytes([value])) for value in values) + b']')
+    return re.compile(b'(?=' + b''.join(parts) + b')', re.DOTALL)
+
+def full_run(mask):
+    '''
+    return (start, end) of the longest run of bytes of mask with every bit set
+    '''
+    best = (0, 0)
+    start = None
+    for pos, byte_mask in enumerate(bytes(mask) + b'\x00'):
+        if byte_mask == 0xFF and start is None:
+            start = pos
+        elif byte_mask != 0xFF and start is not None:
+            best = max(best, (start, pos), key=lambda run: run[1] - run[0])
+            start = None
+    return best
+
+def iter_masked(data, pattern, mask):
+    '''
+    Generator of the offsets of pattern in data, only the bits set in mask being
+    compared. The longest part of pattern without wildcard is looked for with
+    bytes.find, each candidate is then checked as a whole. Without such a part, a
+    regex is used.
+    '''
+    anchor_start, anchor_end = full_run(mask)
+    if anchor_start == anchor_end:
+        for match in mask_regex(pattern, mask).finditer(data):
+            yield match.start()
+        return
+    anchor = pattern[anchor_start:anchor_end]
+    masked_pattern = bytes(map(and_, pattern, mask))
+    pos = data.find(anchor, anchor_start)
+    while pos != -1:
+        start = pos - anchor_start
+        if start + len(pattern) <= len(data) and bytes(map(and_, data[start:start + len(pattern)], mask)) == masked_pattern:
+            yield start
+        pos = data.find(anchor, pos + 1)
+
+def find(file, pattern, mask = None):
+    '''
+    Generator of the addresses of the occurrences of pattern in file, in address order
+        Input   * file : SRecordFile object (or any object with iter_sector_data)
+                * pattern : bytes to look for
+                * mask : bytes of the same length, only the bits set in mask are
+                  compared (see parse_pattern), None to compare every bit
+    Occurrences can overlap, but can't go over a gap between two sectors.
+    Without mask (or with a full one) bytes.find is used, else see iter_masked.
+    '''
+    if mask is not None and len(mask) != len(pattern):
+        raise QueryError("The pattern and its mask must have the same length")
+    if mask is not None and mask.count(0xFF) == len(mask):
+        mask = None
+    for start, data in file.iter_sector_data():
+        if mask is not None:
+            for offset in iter_masked(data, pattern, mask):
+                yield start + offset
+            continue
+        pos = data.find(pattern)
+        while pos != -1:
+            yield start + pos
+            pos = data.find(pattern, pos + 1)
+
+#printable ASCII bytes are displayed as they are, the other ones as '.'
+DUMP_CHARS = bytes(byte if 0x20 <= byte < 0x7F else ord('.') for byte in range(256))
+
+def hexdump(file, address, size, width = 16):
+    '''
+    Generator of the lines of the hexadecimal dump of a range : address, bytes in
+    hexadecimal and as ASCII characters. The bytes missing (gaps between sectors)
+    are displayed as '--' and ' '
+    Each row is sliced from the pieces of iter_range, no byte is handled on its own.
+    '''
+    pieces = list(iter_range(file, address, size))
+    piece_idx = 0
+    for row in range(address - address%width, address + size, width):
+        row_end = row + width
+        hex_cells, ascii_cells = [], []
+        crt_addr = row
+        while piece_idx < len(pieces):
+            start, data = pieces[piece_idx]
+            if start >= row_end:
+                break
+            first, stop = max(start, crt_addr), min(start + len(data), row_end)
+            if first > crt_addr:
+                hex_cells.append(' '.join(['--']*(first - crt_addr)))
+                ascii_cells.append(' '*(first - crt_addr))
+            chunk = data[first - start:stop - start]
+            hex_cells.append(chunk.hex(' ').upper())
+            ascii_cells.append(chunk.translate(DUMP_CHARS).decode('ascii'))
+            crt_addr = stop
+            if start + len(data) > row_end:
+                break
+            piece_idx += 1
+        if crt_addr < row_end:
+            hex_cells.append(' '.join(['--']*(row_end - crt_addr)))
+            ascii_cells.append(' '*(row_end - crt_addr))
+        yield f"{file.addrFormat.format(row)}  {' '.join(hex_cells)}  |{''.join(ascii_cells)}|"
@@ -0,0 +1,456 @@
+import SRecord as sr
+import SRecordConvert as srcv
+import SRecordDiff as srd
+import SRecordFile as srf
+import SRecordImage as sri
+import argparse
+import asyncio
+import itertools
+import json
+import os
+
+from contextlib import asynccontextmanager
+
+#############################################################################
+# Patching service : images are kept loaded by an asyncio server and shared by
+# many clients (flashing stations). Requests and responses are JSON objects,
+# one per line, over a Unix socket or a localhost TCP port.
+#   request  : {"id" : 1, "op" : "read", "path" : "app.s19", "address" : 256, "size" : 16}
+#   response : {"id" : 1, "ok" : true, "result" : "00010203..."}
+#              {"id" : 1, "ok" : false, "error" : "Range is not inside a sector of the image"}
+# Data is given as hexadecimal strings, addresses and sizes as integers.
+#############################################################################
+
+class ServiceError(Exception):
+    pass
+
+#the errors of the requests, any other one is a bug of the service (still answered)
+REQUEST_ERRORS = (ServiceError, srf.SRecordFileError, sr.SRecordError, srcv.ConvertError, OSError, KeyError, ValueError, TypeError)
+
+#limit of a request line, in bytes
+MAX_REQUEST = 1 << 26
+
+def load_image(path):
+    '''
+    Parse the file at path, in a process of the pool of the service (the image is
+    sent back to the event loop pickled)
+    '''
+    return sri.SRecordImage(path)
+
+def validate_path(path):
+    '''
+    Check the checksums of every line of the file at path, in a process of the pool
+    Output : a list of (line number, error message)
+    '''
+    return srf.validate_chunk(path, 0, os.path.getsize(path))[1]
+
+class ReadWriteLock:
+    '''
+    asyncio lock shared by many readers or held by one writer. A writer waiting
+    for the lock goes before the readers arriving after it.
+    '''
+
+    def __init__(self):
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+        self.condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def read(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.writer and not self.waiting_writers)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @asynccontextmanager
+    async def write(self):
+        async with self.condition:
+            self.waiting_writers += 1
+            try:
+                await self.condition.wait_for(lambda: not self.writer and not self.readers)
+            finally:
+                self.waiting_writers -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+class OpenImage:
+    '''
+    An image loaded by the service, with the lock of its accesses. Once the image
+    is closed, the requests still waiting for the lock fail instead of using it.
+    '''
+    def __init__(self, image):
+        self.image = image
+        self.lock = ReadWriteLock()
+        self.closed = False
+
+    def check_open(self):
+        if self.closed:
+            raise ServiceError(f"{self.image.name} was closed")
+
+    @asynccontextmanager
+    async def read(self):
+        async with self.lock.read():
+            self.check_open()
+            yield
+
+    @asynccontextmanager
+    async def write(self):
+        async with self.lock.write():
+            self.check_open()
+            yield
+
+class SRecordService:
+    '''
+    Keep SRecord images loaded (see SRecordImage) and serve their operations to
+    concurrent clients. Reads share the lock of an image, patches and saves take
+    it alone. Parsing and checksum validation are done in a pool of processes,
+    writing files in threads : the event loop never waits for them.
+    '''
+
+    def __init__(self, workers = None, loader = load_image):
+        '''
+        workers : number of processes of the pool (by default, one per CPU)
+        loader : picklable function parsing a path into an SRecordImage
+        '''
+        self.loader = loader
+        self.pool = srf.process_pool(workers)
+        self.images = {}
+        #images being loaded : path -> task, so that a file is parsed once
+        self.loading = {}
+        self.ops = {
+            'open' : self.open,
+            'close' : self.close,
+            'list' : self.list,
+            'read' : self.read,
+            'patch' : self.patch,
+            'diff' : self.diff,
+            'export' : self.export,
+            'save' : self.save,
+            'validate' : self.validate,
+            }
+
+    async def get(self, path):
+        '''
+        return the OpenImage of path, the file is parsed in the pool if it is not loaded yet
+        '''
+        key = os.path.abspath(path)
+        if key in self.images:
+            return self.images[key]
+        if key not in self.loading:
+            loop = asyncio.get_running_loop()
+            self.loading[key] = asyncio.ensure_future(loop.run_in_executor(self.pool, self.loader, key))
+        try:
+            image = await asyncio.shield(self.loading[key])
+        finally:
+            if key in self.loading and self.loading[key].done():
+                del self.loading[key]
+        return self.images.setdefault(key, OpenImage(image))
+
+    ##########
+    # Requests
+    ##########
+
+    async def open(self, path):
+        entry = await self.get(path)
+        async with entry.read():
+            image = entry.image
+            return {'name' : image.name, 'sectors' : [list(sector) for sector in image.sectors],
+                    'lower_addr' : image.lower_addr, 'higher_addr' : image.higher_addr}
+
+    async def close(self, path, save = True):
+        '''
+        drop the image of path, saved first if save is set
+        '''
+        entry = self.images.get(os.path.abspath(path))
+        if entry is None:
+            raise ServiceError(f"{path} is not open")
+        async with entry.write():
+            saved = await asyncio.to_thread(entry.image.save) if save else None
+            entry.closed = True
+            self.images.pop(os.path.abspath(path), None)
+        return saved
+
+    async def list(self):
+        return [{'path' : key, 'changes' : entry.image.has_changes()} for key, entry in self.images.items()]
+
+    async def read(self, path, address, size):
+        entry = await self.get(path)
+        async with entry.read():
+            return entry.image.read_range(address, size).hex().upper()
+
+    async def patch(self, path, writes):
+        '''
+        writes : list of [address, hex data], checked before anything is written
+        Output : the number of bytes written
+        '''
+        writes = [(address, bytes.fromhex(data)) for address, data in writes]
+        entry = await self.get(path)
+        async with entry.write():
+            entry.image.write_many(writes)
+        return sum(len(data) for address, data in writes)
+
+    async def diff(self, path, other):
+        '''
+        compare the image of other with the one of path (see SRecordDiff.diff_images)
+        '''
+        old, new = await self.get(path), await self.get(other)
+        #the locks are always taken in the same order
+        first, second = sorted((old, new), key=id)
+        async with first.read(), second.read():
+            image_diff = await asyncio.to_thread(srd.diff_images, old.image, new.image)
+        return {name : [list(bounds) for bounds in ranges] for name, ranges in
+                (('changed', image_diff.changed), ('added', image_diff.added), ('removed', image_diff.removed))}
+
+    async def export(self, path, output, out_format = None):
+        '''
+        write the image of path (with its changes) into output, in out_format
+        ('srec', 'ihex' or 'bin', found from the extension of output by default)
+        '''
+        if os.path.abspath(output) == os.path.abspath(path):
+            raise ServiceError("An image can't be exported into its own file, use save")
+        out_format = out_format or srcv.format_of(output)
+        entry = await self.get(path)
+        async with entry.read():
+            if out_format == 'srec':
+                await asyncio.to_thread(entry.image.export, output)
+            else:
+                await asyncio.to_thread(srcv.convert, entry.image, output, out_format)
+        return output
+
+    async def save(self, path):
+        '''
+        Output : True if the lines were written in place, False if the whole file
+                 was written, None if there was nothing to save (see SRecordFile.save)
+        '''
+        entry = await self.get(path)
+        async with entry.write():
+            return await asyncio.to_thread(entry.image.save)
+
+    async def validate(self, path):
+        '''
+        check the checksums of the file at path, as it is on the disk
+        Output : a list of [line number, error message]
+        '''
+        loop = asyncio.get_running_loop()
+        return [list(error) for error in await loop.run_in_executor(self.pool, validate_path, path)]
+
+    ############
+    # Connections
+    ############
+
+    async def handle(self, request):
+        '''
+        Run a request (a dictionary), return its response (an error one if it raised)
+        '''
+        response = {'id' : request.get('id')}
+        try:
+            args = dict(request)
+            args.pop('id', None)
+            op = args.pop('op', None)
+            if op not in self.ops:
+                raise ServiceError(f"Unknown operation {op}")
+            response['result'] = await self.ops[op](**args)
+            response['ok'] = True
+        except REQUEST_ERRORS as e:
+            response['ok'] = False
+            response['error'] = str(e) or type(e).__name__
+        except Exception as e:
+            response['ok'] = False
+            response['error'] = f"Internal error of the service : {type(e).__name__} {e}"
+        return response
+
+    async def handle_connection(self, reader, writer):
+        '''
+        Serve the requests of a client, each one in its own task : a slow request
+        does not hold the next ones, the responses are sent as soon as they are ready
+        '''
+        tasks = set()
+
+        def send(response):
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+
+        async def answer(request):
+            send(await self.handle(request))
+            await writer.drain()
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    #the end of the line is not known : the next requests can't be read
+                    send({'id' : None, 'ok' : False, 'error' : f"Request longer than {MAX_REQUEST} bytes, closing the connection"})
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("A request must be a JSON object")
+                except ValueError as e:
+                    send({'id' : None, 'ok' : False, 'error' : str(e)})
+                    continue
+                task = asyncio.ensure_future(answer(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, socket_path = None, host = '127.0.0.1', port = 0):
+        '''
+        Start serving on the Unix socket socket_path, or on host:port (an unused port if 0)
+        Output : the asyncio server
+        '''
+        if socket_path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, socket_path, limit=MAX_REQUEST)
+        return await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST)
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+class SRecordClient:
+    '''
+    Client of an SRecordService : every method sends a request and waits for its
+    response, several requests can be waited for at the same time
+    '''
+
+    def __init__(self, reader = None, writer = None):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.receiver = asyncio.ensure_future(self.receive()) if reader is not None else None
+
+    @classmethod
+    async def connect(cls, socket_path = None, host = '127.0.0.1', port = None):
+        if socket_path is not None:
+            reader, writer = await asyncio.open_unix_connection(socket_path, limit=MAX_REQUEST)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=MAX_REQUEST)
+        return cls(reader, writer)
+
+    async def receive(self):
+        try:
+            while line := await self.reader.readline():
+                response = json.loads(line)
+                future = self.pending.pop(response['id'], None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ServiceError("Connection closed by the service"))
+            self.pending.clear()
+
+    async def send(self, request):
+        '''
+        send a request, return its response
+        '''
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request['id']] = future
+        self.writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        await self.writer.drain()
+        return await future
+
+    async def request(self, op, **args):
+        '''
+        Output : the result of the operation op
+        raise ServiceError with the message of the service if it failed
+        '''
+        response = await self.send({'id' : next(self.ids), 'op' : op, **args})
+        if not response['ok']:
+            raise ServiceError(response['error'])
+        return response['result']
+
+    async def open(self, path):
+        return await self.request('open', path=path)
+
+    async def close(self, path, save = True):
+        return await self.request('close', path=path, save=save)
+
+    async def list(self):
+        return await self.request('list')
+
+    async def read(self, path, address, size):
+        return bytes.fromhex(await self.request('read', path=path, address=address, size=size))
+
+    async def patch(self, path, address, data):
+        return await self.request('patch', path=path, writes=[[address, bytes(data).hex()]])
+
+    async def patch_many(self, path, writes):
+        return await self.request('patch', path=path, writes=[[address, bytes(data).hex()] for address, data in writes])
+
+    async def diff(self, path, other):
+        return await self.request('diff', path=path, other=other)
+
+    async def export(self, path, output, out_format = None):
+        return await self.request('export', path=path, output=output, out_format=out_format)
+
+    async def save(self, path):
+        return await self.request('save', path=path)
+
+    async def validate(self, path):
+        return await self.request('validate', path=path)
+
+    async def disconnect(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        await self.receiver
+
+class LocalClient(SRecordClient):
+    '''
+    Stand-in of SRecordClient calling a service of the same event loop directly,
+    without a socket : the requests go through the same JSON encoding
+    '''
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    async def send(self, request):
+        return json.loads(json.dumps(await self.service.handle(json.loads(json.dumps(request)))))
+
+    async def disconnect(self):
+        pass
+
+async def serve(socket_path, host, port, workers):
+    service = SRecordService(workers)
+    server = await service.start(socket_path, host, port)
+    try:
+        address = socket_path or '{}:{}'.format(*server.sockets[0].getsockname()[:2])
+        print(f"SRecord service listening on {address}")
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.shutdown()
+
+def main():
+    service_pars = argparse.ArgumentParser(description="Serve SRecord images to concurrent clients")
+    service_pars.add_argument('-u', '--unix_socket', help='Path of the Unix socket to listen on')
+    service_pars.add_argument('-p', '--port', help='localhost TCP port to listen on (if no Unix socket is given)', type=int, default=8019)
+    service_pars.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+    service_pars.add_argument('-j', '--jobs', help='Number of processes parsing and validating the files', type=int)
+    args = service_pars.parse_args()
+    try:
+        asyncio.run(serve(args.unix_socket, args.host, args.port, args.jobs))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import collections
+import time
+
+from contextlib import contextmanager
+
+#########################################################################
+# Opt-in instrumentation of the hot paths : counters (bytes read, records
+# parsed, lookups...) and timers (load, save...). While it is disabled, an
+# instrumented path only checks the enabled flag.
+#########################################################################
+
+#Counters kept by the instrumented paths
+BYTES_READ = 'bytes_read'
+BYTES_WRITTEN = 'bytes_written'
+RECORDS_PARSED = 'records_parsed'
+LOOKUPS = 'lookups'
+BISECT_CALLS = 'bisect_calls'
+CHECKSUMS = 'checksums_computed'
+CACHE_HITS = 'cache_hits'
+
+class SRecordStats:
+    '''
+    Counters and timers of the operations done on SRecord files. Hooks are called
+    with (kind, name, value) each time a counter ('count', value added) or a timer
+    ('time', seconds spent) is updated.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = collections.Counter()
+        self.timers = collections.Counter()
+        self.timer_calls = collections.Counter()
+        self.hooks = []
+
+    def enable(self, enabled = True):
+        self.enabled = enabled
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+        self.timer_calls.clear()
+
+    def add_hook(self, hook):
+        '''
+        hook : function called with (kind, name, value), see SRecordStats
+        '''
+        self.hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def count(self, name, value = 1):
+        '''
+        add value to the counter name (nothing is done while disabled)
+        '''
+        if not self.enabled:
+            return
+        self.counters[name] += value
+        for hook in self.hooks:
+            hook('count', name, value)
+
+    @contextmanager
+    def timer(self, name):
+        '''
+        context manager adding the time spent in it to the timer name
+        '''
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timers[name] += elapsed
+            self.timer_calls[name] += 1
+            for hook in self.hooks:
+                hook('time', name, elapsed)
+
+    def snapshot(self):
+        '''
+        return the counters and the timers, as {'counters' : {name : value},
+        'timers' : {name : (number of calls, seconds)}}
+        '''
+        return {'counters' : dict(self.counters),
+                'timers' : {name : (self.timer_calls[name], seconds) for name, seconds in self.timers.items()}}
+
+    def report(self):
+        '''
+        return the counters and the timers as a displayable string
+        '''
+        if not self.counters and not self.timers:
+            return "No statistics recorded" + ("." if self.enabled else " (instrumentation disabled).")
+        lines = [f"   {name:<20}: {value}" for name, value in sorted(self.counters.items())]
+        lines += [f"   {name:<20}: {self.timer_calls[name]} call(s), {seconds*1000:.1f} ms" for name, seconds in sorted(self.timers.items())]
+        return '\n'.join(lines)
+
+#statistics of the process, updated by SRecordFile and SRecordImage
+stats = SRecordStats()
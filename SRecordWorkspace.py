@@ -0,0 +1,123 @@
+import SRecordFile as srf
+import collections
+import os
+
+#default memory budget of a workspace, in bytes
+DEFAULT_BUDGET = 1 << 30
+
+#An image kept open by a workspace, with the digest of the content of its file
+#and the state of the file, (size, modification time), when it was computed
+CachedImage = collections.namedtuple('CachedImage', ['image', 'file_stat', 'digest'])
+
+class SRecordWorkspace:
+    '''
+    Several SRecord files open at the same time, kept in memory in an LRU cache.
+    An image is given back without being parsed again as long as its file did not
+    change (same modification time, or same content digest). When the estimated
+    memory used by the images goes over budget, the least recently used ones are
+    saved (see SRecordFile.save) and dropped.
+    '''
+
+    def __init__(self, loader = srf.SRecordFile, budget = DEFAULT_BUDGET):
+        '''
+        loader : function building an image from a path (SRecordFile, SRecordImage...)
+        budget : memory budget of the workspace, in bytes
+        '''
+        self.loader = loader
+        self.budget = budget
+        self.images = collections.OrderedDict()
+        #paths of the files written by the images already dropped
+        self.saved_paths = set()
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self.images
+
+    def __iter__(self):
+        '''
+        iterate over the images, the least recently used first
+        '''
+        return (cached.image for cached in self.images.values())
+
+    def footprint(self):
+        return sum(image.footprint() for image in self)
+
+    def lookup(self, path):
+        '''
+        return the image of path if it is open and still matches its file, else None
+        (an image with unsaved changes is always given back)
+        '''
+        key = os.path.abspath(path)
+        cached = self.images.get(key)
+        if cached is None:
+            return None
+        image = cached.image
+        if not image.has_changes():
+            crt_stat = srf.file_stat(path)
+            if crt_stat != image.file_stat:
+                #the file was touched : the image is kept only if it was not saved since
+                #the digest was computed, and if the content of the file is the same
+                if image.file_stat != cached.file_stat or srf.file_digest(path) != cached.digest:
+                    del self.images[key]
+                    return None
+                image.file_stat = crt_stat
+                self.images[key] = cached._replace(file_stat=crt_stat)
+        self.images.move_to_end(key)
+        return image
+
+    def open(self, path, keep = ()):
+        '''
+        return the image of the file at path, loaded if it is not open yet
+        keep : images which must not be dropped to make room for it
+        '''
+        image = self.lookup(path)
+        if image is None:
+            image = self.loader(path)
+            #the digest is computed by the loader when it uses the cache of parsed images
+            digest = image.digest or srf.file_digest(path)
+            self.images[os.path.abspath(path)] = CachedImage(image=image, file_stat=image.file_stat, digest=digest)
+            self.evict(keep=[image, *keep])
+        return image
+
+    def replace(self, image):
+        '''
+        put image in the workspace in place of the image open for the same file
+        (e.g. the SRecordImage built from an SRecordFile, see SRecordImage.from_file)
+        '''
+        key = os.path.abspath(image.path)
+        self.images[key] = self.images[key]._replace(image=image)
+        self.images.move_to_end(key)
+        return image
+
+    def evict(self, keep = ()):
+        '''
+        drop the least recently used images, except the ones of keep, until the
+        workspace fits its budget
+        '''
+        for key in list(self.images):
+            if self.footprint() <= self.budget:
+                break
+            if not any(self.images[key].image is image for image in keep):
+                self.close(key)
+
+    def save_all(self):
+        '''
+        save every image, see SRecordFile.save
+        '''
+        for image in self:
+            image.save()
+
+    def close(self, path):
+        '''
+        save the image of path and drop it
+        '''
+        key = os.path.abspath(path)
+        image = self.images.pop(key).image
+        image.save()
+        if image.modified:
+            self.saved_paths.add(key)
+
+    def modified_paths(self):
+        '''
+        return the set of the paths of the files written since they were opened
+        '''
+        return self.saved_paths | {key for key, cached in self.images.items() if cached.image.modified}
@@ -0,0 +1,30 @@
+import SRec_main
+import SRecord as sr
+import SRecordFile as srf
+
+def test_batch_script_stops_on_printed_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(SRec_main, 'strict', False)
+    monkeypatch.setattr(SRec_main, 'make_backups', True)
+    path = tmp_path / 'app.s19'
+    path.write_text('\n'.join([sr.format_srec('S1', 0x1000, bytes(16)), sr.format_srec('S9', 0, b'')]) + '\n')
+    content = path.read_text()
+    #remap_sector only prints its error in the prompt
+    lines = ['patch -a 1000 -v 77', 'remap_sector -s 9999 -n 0', f"convert -o {tmp_path / 'out.s19'}"]
+    output, timings, error = SRec_main.run_script(str(path), lines, srf.SRecordFile)
+    assert error is not None
+    assert path.read_text() == content
+    assert not (tmp_path / 'out.s19').exists()
+
+def test_commands_report_file_errors_in_the_prompt(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(SRec_main, 'strict', False)
+    monkeypatch.setattr(SRec_main, 'make_backups', False)
+    path = tmp_path / 'app.s19'
+    path.write_text('\n'.join([sr.format_srec('S1', 0x1000, bytes(16)), sr.format_srec('S9', 0, b'')]) + '\n')
+    file = srf.SRecordFile(str(path))
+    missing = str(tmp_path / 'missing.s19')
+    SRec_main.run_command(file, 'copy', ['-a', '1000', '-s', '4', '-sf', missing])
+    SRec_main.run_command(file, 'copy', ['-a', '2000', '-s', '4'])
+    SRec_main.run_command(file, 'diff', ['-f', missing])
+    SRec_main.run_command(file, 'patch_by_file', ['-pf', missing])
+    assert SRec_main.run_command(file, 'change_working_file', ['-f', missing]) is file
+    assert len(capsys.readouterr().out.splitlines()) == 5
@@ -0,0 +1,11 @@
+import SRecord as sr
+
+import pytest
+
+def test_setitem_writes_a_byte_from_short_hex_strings():
+    srec = sr.SRecord(sr.format_srec('S1', 0x1000, b'\xAA\xBB\xCC'))
+    srec[0] = ''
+    srec[1] = 'f'
+    assert srec.to_string() == sr.format_srec('S1', 0x1000, b'\x00\x0F\xCC')
+    with pytest.raises(sr.UpdateSRecError):
+        srec[2] = '123'
@@ -0,0 +1,18 @@
+import SRecord as sr
+import SRecordCache as src
+import SRecordFile as srf
+import SRecordImage as sri
+
+def test_file_and_image_layouts_are_cached_apart(tmp_path, monkeypatch):
+    monkeypatch.setattr(src, 'CACHE_DIR', str(tmp_path / 'cache'))
+    path = tmp_path / 'app.s19'
+    #sectors out of address order and a count SRecord
+    lines = [sr.format_srec('S1', 0x2000, bytes(16)), sr.format_srec('S1', 0x1000, bytes(16)),
+             sr.format_srec('S5', 2, b''), sr.format_srec('S9', 0, b'')]
+    path.write_text('\n'.join(lines) + '\n')
+    for file_class in (srf.SRecordFile, sri.SRecordImage, srf.SRecordFile, sri.SRecordImage):
+        cached = file_class(str(path), cache=True)
+        parsed = file_class(str(path))
+        assert cached.sectors == parsed.sectors
+        assert list(cached.footer) == list(parsed.footer)
+        assert [srec.to_string() for srec in cached.data.values()] == [srec.to_string() for srec in parsed.data.values()]
@@ -0,0 +1,37 @@
+import SRecord as sr
+import SRecordConvert as srcv
+import SRecordFile as srf
+import SRecordImage as sri
+
+import pytest
+
+LOADERS = [srf.SRecordFile, sri.SRecordImage, srf.SRecordFile.open_streaming]
+
+def write_srec(path):
+    '''
+    16 bytes at 0x1000, an S5 count SRecord before the S9 entry address 0x1234
+    '''
+    lines = [sr.format_srec('S0', 0, b'app'), sr.format_srec('S1', 0x1000, bytes(range(16))),
+             sr.format_srec('S5', 1, b''), sr.format_srec('S9', 0x1234, b'')]
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+@pytest.mark.parametrize('loader', LOADERS)
+def test_binary_ignores_count_record(tmp_path, loader):
+    source = loader(write_srec(tmp_path / 'app.s19'))
+    assert srcv.write_binary(source, str(tmp_path / 'app.bin')) == 0x1000
+    assert (tmp_path / 'app.bin').read_bytes() == bytes(range(16))
+
+@pytest.mark.parametrize('loader', LOADERS)
+def test_entry_ignores_count_record(tmp_path, loader):
+    source = loader(write_srec(tmp_path / 'app.s19'))
+    assert srcv.headers_and_entry(source)[1] == 0x1234
+    srcv.convert(source, str(tmp_path / 'app.hex'))
+    assert srcv.IntelHexSource(str(tmp_path / 'app.hex')).entry == 0x1234
+    srcv.convert(source, str(tmp_path / 'out.s19'))
+    assert (tmp_path / 'out.s19').read_text().splitlines()[-1] == sr.format_srec('S9', 0x1234, b'')
+
+def test_ihex_round_trip(tmp_path):
+    source = srf.SRecordFile(write_srec(tmp_path / 'app.s19'))
+    srcv.convert(source, str(tmp_path / 'app.hex'), data_len=5)
+    assert list(srcv.IntelHexSource(str(tmp_path / 'app.hex')).iter_sector_data()) == [(0x1000, bytes(range(16)))]
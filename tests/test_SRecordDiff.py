@@ -0,0 +1,19 @@
+import SRecordDiff as srd
+import SRecordFile as srf
+
+def test_diff_buffers_finds_runs(monkeypatch):
+    monkeypatch.setattr(srd, 'DIFF_CHUNK', 64)
+    monkeypatch.setattr(srd, 'DIFF_MIN_BLOCK', 16)
+    old = bytes(256)
+    new = bytearray(old)
+    new[3] = 1
+    new[60:70] = b'\xFF'*10
+    new[200:256] = b'\x80'*56
+    changed = []
+    srd.diff_buffers(old, new, 0x1000, changed)
+    assert changed == [srf.Sector(0x1003, 0x1003), srf.Sector(0x103C, 0x1045), srf.Sector(0x10C8, 0x10FF)]
+
+def test_diff_buffers_fully_different():
+    changed = []
+    srd.diff_buffers(bytes(3 << 20), b'\x01'*(3 << 20), 0, changed)
+    assert changed == [srf.Sector(0, (3 << 20) - 1)]
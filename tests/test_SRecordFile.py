@@ -0,0 +1,59 @@
+import SRecord as sr
+import SRecordFile as srf
+import SRecordImage as sri
+
+import os
+import pytest
+
+def state(file):
+    return (file.sectors, [srec.to_string() for srec in file.header.values()], [srec.to_string() for srec in file.footer.values()],
+            [(srec.to_string(), srec.offset) for srec in file.data.values()], file.lower_addr, file.higher_addr)
+
+@pytest.mark.parametrize('file_class', [srf.SRecordFile, sri.SRecordImage])
+def test_parallel_load_matches_sequential_load(tmp_path, monkeypatch, file_class):
+    monkeypatch.setattr(srf, 'PARALLEL_MIN_CHUNK', 1 << 6)
+    path = tmp_path / 'app.s19'
+    #sectors out of address order, spread over several chunks
+    lines = [sr.format_srec('S0', 0, b'app')]
+    lines += [sr.format_srec('S1', address, bytes(range(16))) for address in (0x300, 0x310, 0x100, 0x110, 0x120, 0x500)]
+    lines += [sr.format_srec('S5', 6, b''), sr.format_srec('S9', 0, b'')]
+    path.write_text('\n'.join(lines) + '\n')
+    assert state(file_class(str(path), workers=3)) == state(file_class(str(path)))
+
+def srec_lines(patches = {}):
+    data = {address: bytearray(range(address & 0xFF, (address & 0xFF) + 16)) for address in (0x100, 0x110, 0x120)}
+    for address, value in patches.items():
+        data[address & ~0xF][address & 0xF] = value
+    return [sr.format_srec('S0', 0, b'app')] + [sr.format_srec('S1', address, data[address]) for address in data] + [sr.format_srec('S9', 0, b'')]
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('eol', ['\n', '\r\n'])
+def test_save_writes_the_dirty_lines_in_place(tmp_path, lazy, eol):
+    path = tmp_path / 'app.s19'
+    path.write_bytes(eol.join(srec_lines()).encode('ascii') + eol.encode('ascii'))
+    file = srf.SRecordFile(str(path), lazy=lazy)
+    file.write_range(0x115, b'\xAA')
+    file.write_range(0x120, b'\xBB')
+    assert file.save() is True
+    assert path.read_bytes() == eol.join(srec_lines({0x115: 0xAA, 0x120: 0xBB})).encode('ascii') + eol.encode('ascii')
+    assert file.save() is None
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('eol', ['\n', '\r\n'])
+def test_save_rewrites_a_file_changed_on_disk(tmp_path, lazy, eol):
+    path = tmp_path / 'app.s19'
+    content = eol.join(srec_lines()).encode('ascii') + eol.encode('ascii')
+    path.write_bytes(content)
+    file = srf.SRecordFile(str(path), lazy=lazy)
+    #written again by someone else : same content, but the file can't be trusted
+    path.write_bytes(content)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    file.write_range(0x115, b'\xAA')
+    assert file.save() is False
+    #the whole file is written in text mode, the offsets of its new lines are used afterwards
+    assert path.read_bytes() == os.linesep.join(srec_lines({0x115: 0xAA})).encode('ascii') + os.linesep.encode('ascii')
+    file.write_range(0x100, b'\xCC')
+    file.write_range(0x12F, b'\xDD')
+    assert file.save() is True
+    assert path.read_bytes() == os.linesep.join(srec_lines({0x115: 0xAA, 0x100: 0xCC, 0x12F: 0xDD})).encode('ascii') + os.linesep.encode('ascii')
@@ -0,0 +1,121 @@
+import SRecord as sr
+import SRecordFile as srf
+import SRecordImage as sri
+import SRecordJournal as srj
+
+import pytest
+
+LINES = [(0x1000 + 16*idx, bytes(range(16*idx, 16*idx + 16))) for idx in range(4)]
+
+def write_srec(path, bad_line = None):
+    '''
+    write an S1 file made of LINES, the checksum of the line number bad_line is wrong
+    '''
+    text = [sr.format_srec('S0', 0, b'test')]
+    for idx, (address, data) in enumerate(LINES):
+        line = sr.format_srec('S1', address, data)
+        if idx == bad_line:
+            line = line[:-2] + f"{int(line[-2:], 16) ^ 0xFF:02X}"
+        text.append(line)
+    text.append(sr.format_srec('S9', 0, b''))
+    path.write_text('\n'.join(text) + '\n')
+    return path
+
+def test_verify_checksums_reports_bad_line(tmp_path):
+    path = write_srec(tmp_path / 'bad.s19', bad_line=2)
+    assert sri.SRecordImage(str(path)).verify_checksums() == [LINES[2][0]]
+    with pytest.raises(srf.ChecksumSrecFileError):
+        sri.SRecordImage(str(path), verify=True)
+
+def test_fix_checksums_rewrites_bad_line(tmp_path):
+    path = write_srec(tmp_path / 'bad.s19', bad_line=2)
+    image = sri.SRecordImage(str(path))
+    changes = image.fix_checksums()
+    assert [srec.address_u for srec, old in changes] == [LINES[2][0]]
+    assert image.verify_checksums() == []
+    assert image.save() is True
+    assert path.read_text() == write_srec(tmp_path / 'good.s19').read_text()
+
+def test_undo_fix_checksums_restores_bad_line(tmp_path):
+    path = write_srec(tmp_path / 'bad.s19', bad_line=2)
+    bad_text = path.read_text()
+    image = sri.SRecordImage(str(path))
+    journal = srj.Journal()
+    journal.fix_checksums(image)
+    image.save()
+    journal.undo(image)
+    image.save()
+    assert path.read_text() == bad_text
+    assert image.verify_checksums() == [LINES[2][0]]
+
+def test_written_line_gets_fresh_checksum(tmp_path):
+    path = write_srec(tmp_path / 'bad.s19', bad_line=2)
+    image = sri.SRecordImage(str(path))
+    image.write_range(LINES[1][0], b'\xAA')
+    image.save()
+    assert sri.SRecordImage(str(path)).verify_checksums() == [LINES[2][0]]
+
+def test_remap_cuts_lines_too_long_for_their_new_type(tmp_path):
+    path = tmp_path / 'full.s19'
+    data = bytes(range(252))
+    path.write_text('\n'.join([sr.format_srec('S1', 0x1000, data), sr.format_srec('S1', 0x10FC, data[:4]), sr.format_srec('S9', 0, b'')]) + '\n')
+    image = sri.SRecordImage(str(path))
+    image.remap_sector(0x1000, 0x20000)
+    assert [(srec.s_type, srec.address_u, len(srec.data)) for srec in image.data.values()] == [('S2', 0x20000, 251), ('S2', 0x200FB, 1), ('S2', 0x200FC, 4)]
+    image.export(str(tmp_path / 'moved.s19'))
+    moved = sri.SRecordImage(str(tmp_path / 'moved.s19'), verify=True)
+    assert moved.read_range(0x20000, 256) == data + data[:4]
+
+def test_fill_gaps_rejects_lines_too_long(tmp_path):
+    path = write_srec(tmp_path / 'gap.s19')
+    image = sri.SRecordImage(str(path))
+    image.trim(0x1010, 0x101F)
+    with pytest.raises(srf.SRecordFileError):
+        image.fill_gaps(0x1000, 0x103F, data_len=253)
+    assert image.fill_gaps(0x1000, 0x103F, data_len=8) == 16
+
+def test_fill_gaps_widens_the_lines_above_16_bits(tmp_path):
+    path = tmp_path / 'wide.s19'
+    data = bytes(range(252))
+    path.write_text('\n'.join([sr.format_srec('S1', 0xFE00, data), sr.format_srec('S2', 0x10100, data[:4]), sr.format_srec('S9', 0, b'')]) + '\n')
+    image = sri.SRecordImage(str(path))
+    gap_len = 0x10100 - 0xFEFC
+    assert image.fill_gaps(0, 0x1FFFF, fill=0xAA) == gap_len
+    #the 252 bytes lines of the S1 line before the gap are too long for S2 lines
+    assert [(srec.s_type, srec.address_u, len(srec.data)) for srec in image.data.values()] == [
+        ('S1', 0xFE00, 252), ('S2', 0xFEFC, 251), ('S2', 0xFFF7, 1), ('S2', 0xFFF8, 251), ('S2', 0x100F3, 1),
+        ('S2', 0x100F4, 12), ('S2', 0x10100, 4)]
+    image.export(str(tmp_path / 'filled.s19'))
+    filled = sri.SRecordImage(str(tmp_path / 'filled.s19'), verify=True)
+    assert filled.read_range(0xFE00, 0x304) == data + b'\xAA'*gap_len + data[:4]
+
+def test_export_keeps_bad_checksums(tmp_path):
+    path = write_srec(tmp_path / 'bad.s19', bad_line=2)
+    sri.SRecordImage(str(path)).export(str(tmp_path / 'out.s19'))
+    assert (tmp_path / 'out.s19').read_text() == path.read_text()
+
+def test_undo_fix_checksums_then_full_rewrite(tmp_path):
+    path = write_srec(tmp_path / 'bad.s19', bad_line=2)
+    bad_text = path.read_text()
+    image = sri.SRecordImage(str(path))
+    journal = srj.Journal()
+    journal.fix_checksums(image)
+    journal.undo(image)
+    assert image.save(in_place=False) is False
+    assert path.read_text() == bad_text
+    assert image.verify_checksums() == [LINES[2][0]]
+    journal.redo(image)
+    image.save(in_place=False)
+    assert path.read_text() == write_srec(tmp_path / 'good.s19').read_text()
+    assert image.verify_checksums() == []
+
+def test_setitem_checks_the_value_like_srecord(tmp_path):
+    image = sri.SRecordImage(str(write_srec(tmp_path / 'set.s19')))
+    address = LINES[0][0]
+    image[address] = ''
+    image[address + 1] = 'a'
+    assert image.read_range(address, 2) == b'\x00\x0A'
+    for value in ('1234', 'zz', 0x12):
+        with pytest.raises(sr.UpdateSRecError):
+            image[address] = value
+    assert image.read_range(address, 2) == b'\x00\x0A'
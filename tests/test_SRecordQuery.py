@@ -0,0 +1,12 @@
+import SRecord as sr
+import SRecordFile as srf
+import SRecordQuery as srq
+
+def test_hexdump_shows_the_gaps_inside_the_rows(tmp_path):
+    path = tmp_path / 'app.s19'
+    path.write_text('\n'.join([sr.format_srec('S1', 0x1004, b'ABCD\x00\x7f'), sr.format_srec('S1', 0x100C, b'xyz0123'), sr.format_srec('S9', 0, b'')]) + '\n')
+    file = srf.SRecordFile(str(path))
+    assert list(srq.hexdump(file, 0x1002, 0x12, width=8)) == [
+        f"{file.addrFormat.format(0x1000)}  -- -- -- -- 41 42 43 44  |    ABCD|",
+        f"{file.addrFormat.format(0x1008)}  00 7F -- -- 78 79 7A 30  |..  xyz0|",
+        f"{file.addrFormat.format(0x1010)}  31 32 33 -- -- -- -- --  |123     |"]
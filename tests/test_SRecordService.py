@@ -0,0 +1,63 @@
+import SRecord as sr
+import SRecordService as srsv
+
+import asyncio
+import json
+
+def write_srec(path):
+    lines = [sr.format_srec('S1', 0x1000 + 16*idx, bytes(16)) for idx in range(4)]
+    path.write_text('\n'.join(lines + [sr.format_srec('S9', 0, b'')]) + '\n')
+    return str(path)
+
+def test_patch_waiting_for_close_fails(tmp_path):
+    path = write_srec(tmp_path / 'app.s19')
+
+    async def run():
+        service = srsv.SRecordService(workers=1)
+        try:
+            await service.patch(path, [[0x1000, '01']])
+            #the patch waits for the lock while the image is saved and dropped
+            close = asyncio.ensure_future(service.handle({'op' : 'close', 'path' : path}))
+            await asyncio.sleep(0)
+            patch = await service.handle({'op' : 'patch', 'path' : path, 'writes' : [[0x1000, 'FF']]})
+            return await close, patch
+        finally:
+            service.shutdown()
+
+    close, patch = asyncio.run(run())
+    assert close['ok'] and close['result'] is True
+    assert not patch['ok'] and 'closed' in patch['error']
+
+def test_internal_error_is_answered():
+    async def run():
+        service = srsv.SRecordService(workers=1)
+        service.ops['crash'] = lambda: 1/0
+        try:
+            return await service.handle({'id' : 3, 'op' : 'crash'})
+        finally:
+            service.shutdown()
+
+    response = asyncio.run(run())
+    assert response['id'] == 3 and not response['ok'] and 'ZeroDivisionError' in response['error']
+
+def test_request_too_long_closes_connection(monkeypatch):
+    monkeypatch.setattr(srsv, 'MAX_REQUEST', 1 << 10)
+
+    async def run():
+        service = srsv.SRecordService(workers=1)
+        server = await service.start(port=0)
+        try:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            writer.write(b'"' + b'0'*(1 << 12) + b'"\n')
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            closed = await reader.read() == b''
+            writer.close()
+            return response, closed
+        finally:
+            server.close()
+            service.shutdown()
+
+    response, closed = asyncio.run(run())
+    assert not response['ok'] and 'longer' in response['error']
+    assert closed